@@ -19,13 +19,29 @@
 
 import sys
 import json
+import hashlib
+from collections import OrderedDict
 from pprint import pprint, pformat
 import StringIO
 import os
 import logging
 from datetime import date
-import string
 import re
+import time
+import threading
+from contextlib import contextmanager
+from timeit import default_timer
+import argparse
+import functools
+import cProfile
+import cPickle
+import tempfile
+from xml.sax.saxutils import quoteattr
+from multiprocessing.pool import ThreadPool
+try:
+    import resource
+except ImportError:
+    resource = None
 
 DEFAULT_RESPONSE_CODES = {
     "200+"    :  "successCodes",
@@ -68,22 +84,173 @@ NS_DATA_TYPES = {
     "boolean"    : "NSNumber"
 }
 
+# attribute types of the Core Data model file, arrays of primitives are transformable
+CORE_DATA_MODEL_TYPES = {
+    "NSDateAttributeType"      : "Date",
+    "NSInteger16AttributeType" : "Integer 16",
+    "NSInteger32AttributeType" : "Integer 32",
+    "NSInteger64AttributeType" : "Integer 64",
+    "NSDecimalAttributeType"   : "Decimal",
+    "NSDoubleAttributeType"    : "Double",
+    "NSFloatAttributeType"     : "Float",
+    "NSStringAttributeType"    : "String",
+    "NSBooleanAttributeType"   : "Boolean",
+    "NSUndefinedAttributeType" : "Transformable"
+}
+
 force_overwrite = False
 
-logging.basicConfig(level=logging.INFO)
+# compare the generated files with the ones on disk without writing or deleting anything
+dry_run = False
+
+# user field sent as the username by the generated authentication code
+field = "username"
+
+# number of worker threads used to render and write object files
+jobs = 1
+
+# peak resident memory of the process in kilobytes, None where it cannot be measured
+def get_peak_memory():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak = peak / 1024 # reported in bytes instead of kilobytes
+    return peak
+
+class GenerationMetrics(object):
+    """
+    Wall time of every generator phase and how much it raised the peak memory of the process,
+    and counters of the work done during a run. Counters may be updated from the object file
+    workers.
+    """
+
+    def __init__(self):
+        self.phases = OrderedDict()
+        self.counts = OrderedDict()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = default_timer()
+        start_peak = get_peak_memory()
+        try:
+            yield
+        finally:
+            (seconds, growth) = self.phases.get(name, (0.0, 0))
+            if start_peak is None:
+                growth = None
+            else:
+                growth += get_peak_memory() - start_peak
+            self.phases[name] = (seconds + default_timer() - start, growth)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def report(self):
+        lines = ["%-28s %10s %14s" % ("phase", "seconds", "peak growth")]
+        for (name, (seconds, growth)) in self.phases.items():
+            lines.append("%-28s %10.4f %14s" % (name, seconds, "%d KB" % growth if growth is not None else "-"))
+        lines.append("")
+        for (name, n) in self.counts.items():
+            lines.append("%-28s %10d" % (name, n))
+        return "\n".join(lines)
+
+# metrics of the current run, replaced at the start of every generate
+run_metrics = GenerationMetrics()
+
+# directory and file name of the template used for the header of every generated object file
+DEFAULT_TEMPLATE_DIR = os.path.dirname(os.path.realpath(__file__)) + "/"
+template_dir = DEFAULT_TEMPLATE_DIR
+template_file = "manticom.h.template"
+
+
+class RunCache(object):
+    """
+    A cache kept across runs that forgets the entries a run didn't use. Entries looked up or
+    stored since the last prune() are kept by the next one, the others are evicted, so a
+    resident generator holds the entries of its latest run instead of those of every edit.
+    """
+
+    def __init__(self):
+        self.used = {}
+        self.entries = {}
+
+    def __contains__(self, key):
+        return key in self.used or key in self.entries
+
+    def __getitem__(self, key):
+        try:
+            return self.used[key]
+        except KeyError:
+            value = self.used[key] = self.entries[key]
+            return value
+
+    def __setitem__(self, key, value):
+        self.used[key] = value
+
+    def __len__(self):
+        return len(self.used) + len([key for key in self.entries if not key in self.used])
+
+    def clear(self):
+        self.used.clear()
+        self.entries.clear()
 
-def set_subtraction(original_dict, keys_to_remove):
+    def prune(self):
+        self.entries = self.used
+        self.used = {}
+
+# Naming service
+#
+# Every identifier derived from a schema name (class, property, selector and descriptor names)
+# goes through the naming functions below. They are interned: each function caches its results
+# by argument, so the same identifier is only ever derived once per run (see prune_caches).
+interned_names = {}
+
+def interned(function):
+    cache = interned_names.setdefault(function.__name__, RunCache())
+
+    @functools.wraps(function)
+    def lookup(*args):
+        try:
+            return cache[args]
+        except KeyError:
+            result = cache[args] = function(*args)
+            return result
+
+    return lookup
+
+class SymbolRegistry(object):
     """
-    Removes all keys in keys_to_remove from original_dict and returns a new dictionary with the 
-    remaining keys. The original dictionary is unaffected.
+    The Objective-C symbols of one kind emitted in a generated file. Derived names aren't
+    injective (make_suffix maps `users/` and `uploads/` to the same suffix), so a name
+    claimed a second time is disambiguated with the first free numeric suffix, in claim order,
+    and the collision is reported. owner describes the claimant in the report.
     """
-    new_dict = original_dict.copy()
-    for k in keys_to_remove:
-        if k in new_dict:
-            new_dict.pop(k)
 
-    return new_dict
+    def __init__(self, kind):
+        self.kind = kind
+        self.owners = {}
+
+    def claim(self, name, owner):
+        if not name in self.owners:
+            self.owners[name] = owner
+            return name
+
+        n = 2
+        while "%s%d" % (name, n) in self.owners:
+            n += 1
+        unique_name = "%s%d" % (name, n)
+        self.owners[unique_name] = owner
 
+        logging.warning("%s `%s` of %s collides with the one of %s, renamed to `%s`" % (self.kind, name, owner, self.owners[name], unique_name))
+        run_metrics.count("name collisions")
+        return unique_name
+
+SUFFIX_WORD = re.compile(r"[a-zA-Z0-9']+")
+
+@interned
 def make_suffix(input):
     """
     input some string such as:
@@ -91,10 +258,50 @@ def make_suffix(input):
     and the output produces:
         svi
     """
-    output = ''.join([s[0:1] for s in re.findall(r"[a-zA-Z0-9']+", input)])
+    output = ''.join([s[0:1] for s in SUFFIX_WORD.findall(input)])
     return output
 
 
+# keys understood in a url definition that isn't a root response
+URL_DEFINITION_KEYS = frozenset(["url", "keyPath", "doc", "#meta", "get", "post", "put", "patch", "delete"])
+
+def check_url_definition(s):
+    """
+    Ensure that a single entry of `urls` is valid for parsing
+    """
+    status = True
+    if not ("url" in s or "keyPath" in s):
+        logging.warning("Each url definition requires either a `url` or `keyPath`")
+        status = False
+
+    if "url" in s:
+        if s["url"] == "nil":
+            logging.warning("No url can be named `nil`")
+
+    if not "keyPath" in s:
+        unknown_keys = [k for k in s.keys() if not k in URL_DEFINITION_KEYS]
+
+        if len(unknown_keys) > 0:
+            logging.warning("Don't understand: %s" % pformat(unknown_keys))
+            status = False
+
+    return status
+
+def check_object_definition(s):
+    """
+    Ensure that a single entry of `objects` is valid for parsing
+    """
+    if not isinstance(s, dict):
+        logging.error("Every entry in `objects` must be a dictionary")
+    else:
+        if len(s.keys()) != 1:
+            logging.error("Every object entry in `objects` must contain a single key")
+        else:
+            if s.keys()[0][0:1]  != "$":
+                logging.warning("Every object entry in `objects` must begin with a prefix $ for an object name %s " % s.keys()[0])
+
+    return True
+
 def check_schema(schema):
     """
     Ensure that the schema is valid for parsing
@@ -102,66 +309,51 @@ def check_schema(schema):
     status = True
     if not ("urls" in schema and "objects" in schema):
         logging.error("Schema requires two root nodes `urls` and `objects`")
-        status = False
+        return False
 
     if not isinstance(schema["urls"], list):
         logging.error("Schema requires `urls` as a list")
         status = False
     else:
         for s in schema["urls"]:
-            if not ("url" in s or "keyPath" in s):
-                logging.warning("Each url definition requires either a `url` or `keyPath`")
-                status = False
-
-            if "url" in s:
-                if s["url"] == "nil":
-                    logging.warning("No url can be named `nil`")
-
-            if not "keyPath" in s:
-                d = set_subtraction(s, ["url", "keyPath", "doc", "#meta", "post", "get", "post", "patch", "delete"])
-
-                if len(d) > 0:
-                    logging.warning("Don't understand: ")
-                    logging.warning(pprint(d.keys()))
-                    status = False
+            status = check_url_definition(s) and status
 
     if not isinstance(schema["objects"], list):
         logging.error("Schema requires `objects` as a list")
         status = False
     else:
         for s in schema["objects"]:
-            if not isinstance(s, dict):
-                logging.error("Every entry in `objects` must be a dictionary")
-            else:
-                if len(s.keys()) != 1:
-                    logging.error("Every object entry in `objects` must contain a single key")
-                else:
-                    if s.keys()[0][0:1]  != "$":
-                        logging.warning("Every object entry in `objects` must begin with a prefix $ for an object name %s " % s.keys()[0])
-
+            status = check_object_definition(s) and status
 
     return status
 
+@interned
 def titlecase(name):
     """
     Uppercases the first letter
     """
     return "%s%s" % (name[0:1].upper(), name[1:])
 
+@interned
 def anti_titlecase(name):
     """
     Lowercases the first letter
     """
     return "%s%s" % (name[0:1].lower(), name[1:]) 
 
+CAMEL_WORD = re.compile('(.)([A-Z][a-z]+)')
+CAMEL_BOUNDARY = re.compile('([a-z0-9])([A-Z])')
+
+@interned
 def camel_to_underscore(name):
     """
     convert CamelCase classes to URL-style underscore_name_stuff
     """
     # http://stackoverflow.com/questions/1175208/elegant-python-function-to-convert-camelcase-to-camel-case
-    s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
-    return re.sub('([a-z0-9])([A-Z])', r'\1_\2', s1).lower()
+    s1 = CAMEL_WORD.sub(r'\1_\2', name)
+    return CAMEL_BOUNDARY.sub(r'\1_\2', s1).lower()
 
+@interned
 def underscore_to_camel(input):
     """
     converts underscore-style URLs to camel case without the backslash
@@ -191,6 +383,7 @@ def fix_url_path(path):
     return path
 
 # change special Cocoa variable names to something else
+@interned
 def safety_name(name):
     if name == "id":
         # not allowed to use _id because underscore not allowed by Core Data modelling tool
@@ -208,6 +401,7 @@ def safety_name(name):
     else:
         return name
 
+@interned
 def parameter_name(name, state): 
     if name == "id": # id should be especially guarded
         return first_other("Id", "theId", state)
@@ -215,189 +409,396 @@ def parameter_name(name, state):
         return first_other(underscore_to_camel(name), anti_titlecase(underscore_to_camel(name)), state)
 
 
-def find_key_in_array_of_dict(key, value, arr):
-    '''Given a dictionary in the format 
-       [{ 
-               "key" : "value",
-               "k2" : "k2v",
-                "k3" : "k3v"
-          },
-          {
-              "a1" : "a1v",
-              "a2": "a2v",
-              "a3": "a3v"
-          }
-      ]
-      it will extract the object with "key" : "value" in the object
-    '''
-
-    for obj in arr:
-        if obj[key] == value:
-            return obj
-    return None
+def get_object_name_from_reference(reference):
+    """
+    Returns the object name referenced by a request, response, prototype or parameters entry
+    without the $ prefix. Supports either
+        "$someObject"
+    or
+        { "200+" : "$someObject", "keyPath" : "objects" }
+    The reference itself is left untouched.
+    """
+    if isinstance(reference, dict):
+        for (key, value) in reference.items():
+            if key != "keyPath":
+                return value[1:]
+        return None
+    return reference[1:]
+
+# Builds the schema symbol table once per run, so that every lookup from a url definition into
+# the expanded objects is a dictionary access rather than a scan over the whole object list.
+#
+# Output:
+# {'names': [u'changePasswordRequest', u'signupRequest', ...],        # definition order
+#  'objects': {u'changePasswordRequest': <ObjectDef>, ...},
+#  'referenced_by': {u'changePasswordRequest': ['account/password/'], ...}}
+def build_symbol_table(expanded_objects, endpoint_ir):
+    names = []
+    objects = {}
+    referenced_by = {}
+    class_names = {}
 
-def print_object_response_mapping(outfile, var_name, class_name, attrs, subclasses, is_cached):
-    if is_cached:
-        outfile.write('RKEntityMapping* %sResponseMapping = [RKEntityMapping mappingForEntityForName:@"%s" inManagedObjectStore:managedObjectStore];\n' % (var_name, class_name))
+    for d in expanded_objects:
+        if d.var_name in objects:
+            logging.error("Object `%s` is defined more than once" % d.var_name)
+            continue
+        # class names are also file names and are referenced across schemas, so they are reported
+        # rather than renamed
+        if d.class_name in class_names:
+            logging.error("Objects `%s` and `%s` both generate the class `%s`" % (class_names[d.class_name], d.var_name, d.class_name))
+            run_metrics.count("name collisions")
+        class_names[d.class_name] = d.var_name
+        names.append(d.var_name)
+        objects[d.var_name] = d
+        referenced_by[d.var_name] = []
+
+    def add_reference(name, url):
+        if name in referenced_by and not url in referenced_by[name]:
+            referenced_by[name].append(url)
+
+    for endpoint in endpoint_ir["endpoints"]:
+        for op in endpoint["operations"].values():
+            for kind in ["request", "response", "prototype", "parameters"]:
+                if op[kind]:
+                    add_reference(op[kind], endpoint["url"])
+
+    for descriptor in endpoint_ir["root_responses"]:
+        add_reference(descriptor["var_name"], "nil")
+
+    return { "names" : names,
+             "objects" : objects,
+             "referenced_by" : referenced_by }
+
+def find_object(symbols, var_name):
+    """
+    Returns the expanded object named var_name (without the $ prefix) or None
+    """
+    return symbols["objects"].get(var_name)
+
+# relationships=False leaves out the relationship mappings, see print_relationship_mappings
+def print_object_response_mapping(outfile, obj, relationships=True):
+    var_name = obj.var_name
+    if obj.is_cached:
+        outfile.write('RKEntityMapping* %sResponseMapping = [RKEntityMapping mappingForEntityForName:@"%s" inManagedObjectStore:managedObjectStore];\n' % (var_name, obj.class_name))
     else:
-        outfile.write('RKObjectMapping* %sResponseMapping = [RKObjectMapping mappingForClass:[%s class]];\n' % (var_name, class_name))
+        outfile.write('RKObjectMapping* %sResponseMapping = [RKObjectMapping mappingForClass:[%s class]];\n' % (var_name, obj.class_name))
     
-    if len(attrs) > 0:
+    if len(obj.attrs) > 0:
         outfile.write('[%sResponseMapping addAttributeMappingsFromDictionary:@{\n' % var_name)
-        first_time = True
-        for (a, ns, cd, is_primary, is_optional) in attrs:
-            if not first_time:
-                outfile.write(",\n")
-            outfile.write('                                               @"%s":@"%s"' % (a,safety_name(a)))
-            first_time = False
+        outfile.write(",\n".join(['                                               @"%s":@"%s"' % (a.name, a.safety_name) for a in obj.attrs]))
         outfile.write('}];\n')
 
-    
-    primary_a = []
-    for (a, ns, cd, is_primary, is_optional) in attrs:
-        if is_primary:
-            primary_a.append(a)
-    if len(primary_a) > 0:
-        if not is_cached:
+    if len(obj.primary_attrs) > 0:
+        if not obj.is_cached:
             outfile.write("// ")
-        outfile.write('%sResponseMapping.identificationAttributes = @[%s];\n' % (var_name, ','.join([ '@"%s"' % safety_name(some_a) for some_a in primary_a ])))
+        outfile.write('%sResponseMapping.identificationAttributes = @[%s];\n' % (var_name, ','.join([ '@"%s"' % a.safety_name for a in obj.primary_attrs ])))
 
-    for (v, d, is_array) in subclasses:
-        outfile.write('[%sResponseMapping addPropertyMapping:[RKRelationshipMapping relationshipMappingFromKeyPath:@"%s" toKeyPath:@"%s" withMapping:%sResponseMapping]];\n' % (var_name, v, v, d))
+    if relationships:
+        print_relationship_mappings(outfile, obj, "Response")
 
     outfile.write('\n')
 
+# writes the relationship mappings of obj, kind is Request or Response
+def print_relationship_mappings(outfile, obj, kind):
+    for r in obj.subclasses:
+        outfile.write('[%s%sMapping addPropertyMapping:[RKRelationshipMapping relationshipMappingFromKeyPath:@"%s" toKeyPath:@"%s" withMapping:%s%sMapping]];\n' % (obj.var_name, kind, r.name, r.name, r.object_name, kind))
 
-def print_object_request_mapping(outfile, var_name, class_name, attrs, subclasses, is_cached):
+def print_object_request_mapping(outfile, obj, relationships=True):
+    var_name = obj.var_name
     outfile.write('RKObjectMapping* %sRequestMapping = [RKObjectMapping requestMapping];\n' % var_name)
     
-    if len(attrs) > 0:
+    if len(obj.attrs) > 0:
         outfile.write('[%sRequestMapping addAttributeMappingsFromDictionary:@{\n' % var_name)
-        first_time = True
-        for (a, ns, cd, is_primary, is_optional) in attrs:
-            if not first_time:
-                outfile.write(",\n")
-            outfile.write('                                               @"%s":@"%s"' % (safety_name(a),a))
-            first_time = False
+        outfile.write(",\n".join(['                                               @"%s":@"%s"' % (a.safety_name, a.name) for a in obj.attrs]))
         outfile.write('}];\n')
 
-    for (v,d,is_array) in subclasses:
-        outfile.write('[%sRequestMapping addPropertyMapping:[RKRelationshipMapping relationshipMappingFromKeyPath:@"%s" toKeyPath:@"%s" withMapping:%sRequestMapping]];\n' % (var_name, v, v, d))
+    if relationships:
+        print_relationship_mappings(outfile, obj, "Request")
 
     outfile.write('\n')
 
+# matches the {{ name }} placeholders of a template file
+TEMPLATE_PLACEHOLDER = re.compile(r"\{\{ (\w+) \}\}")
+
+compiled_templates = {}
+
+# read a template file once and split it into alternating literal and placeholder segments:
+#   ['//\n//  ', 'viewName', '.', 'extension', '\n//  ', 'projectName', ...]
+# even indexes are literal text, odd indexes are placeholder names
+def compile_template(template):
+    template = os.path.realpath(template)
+    if not template in compiled_templates:
+        f = open(template, "r")
+        contents = f.read()
+        f.close()
+        compiled_templates[template] = TEMPLATE_PLACEHOLDER.split(contents)
+
+    return compiled_templates[template]
+
+# render compiled template segments, replacing placeholders with their assigned values
+# if placeholders are in the template and not listed in dict, they are left untouched
+def render_template(segments, dict):
+    output = []
+    for i in range(len(segments)):
+        if i % 2 == 0:
+            output.append(segments[i])
+        elif segments[i] in dict:
+            output.append(str(dict[segments[i]]))
+        else:
+            output.append("{{ %s }}" % segments[i])
+
+    return "".join(output)
+
+template_patterns = {}
+
+# inverse of render_template: if text starts with a rendering of the template, returns the
+# values that were substituted for each placeholder, otherwise None
+def match_template(segments, text):
+    key = tuple(segments)
+    if not key in template_patterns:
+        pattern = []
+        seen = set()
+        for i in range(len(segments)):
+            if i % 2 == 0:
+                pattern.append(re.escape(segments[i]))
+            elif segments[i] in seen:
+                pattern.append("(?P=%s)" % segments[i])
+            else:
+                pattern.append("(?P<%s>[^\n]*?)" % segments[i])
+                seen.add(segments[i])
+        template_patterns[key] = re.compile("".join(pattern))
+
+    m = template_patterns[key].match(text)
+    if m:
+        return m.groupdict()
+    return None
+
 # read a template file and replace dict keys with their assigned values
 # then return the contents of that file
 def replace_from_template(template, dict):
-    f = open(template, "r")
-    contents = f.read()
-    for (key, value) in dict.items():
-        contents = string.replace(contents, "{{ %s }}" % key, str(value))
-
-    f.close()
-
-    return contents
+    return render_template(compile_template(template), dict)
 
 def get_project_name_from_dir():
     full_dir = os.getcwd()
     dir_parts = full_dir.split("/")
     return dir_parts[-1]
 
+run_template_values = None
 
-def create_object_files(parent_dir, class_name, attrs, subclasses, is_cached):
-    base_object = "NSManagedObject" if is_cached else "NSObject"
-    statement = "@dynamic" if is_cached else "@synthesize"
+# values shared by every rendered template during a run, computed only once
+def get_template_values():
+    global run_template_values
+    if run_template_values is None:
+        today = date.today()
+        run_template_values = {"projectName" : get_project_name_from_dir(),
+                               "date" : today.isoformat(),
+                               "year" : today.year }
+    return run_template_values
 
-    # default out file is to write to memory
-    header_out = None
-    body_out = None    
 
-    filename = titlecase(class_name)
-    current_files = []
+# template values that only record when a file was generated, they are carried over from an
+# existing file so that regenerating identical content leaves the file untouched
+TEMPLATE_DATE_KEYS = ["date", "year"]
 
-    if os.path.isfile(parent_dir + filename + ".h"):
-       if not force_overwrite:
-           logging.info("Skipping %s.h..." % filename)
-           header_out = open(os.devnull, 'w')
-       else:
-           logging.info("Overwriting %s.h..." % filename)
-           header_out = open(parent_dir + filename + ".h", "w")
-    
+def write_file_if_changed(path, contents):
+    """
+    Writes contents to path unless the file already holds exactly the same bytes, so that
+    Xcode does not recompile anything for a no-op regeneration. Nothing is written in a dry run.
+    Returns "added", "changed" or "unchanged"
+    """
+    status = "added"
+    if os.path.isfile(path):
+        f = open(path, "r")
+        existing = f.read()
+        f.close()
+        if existing == contents:
+            return "unchanged"
+        status = "changed"
+
+    if dry_run:
+        return status
+
+    f = open(path, "w")
+    f.write(contents)
+    f.close()
+    run_metrics.count("bytes written", len(contents))
+    return status
+
+# writes a single object file composed of the rendered template followed by contents
+# A dry run always compares existing files, as if they were to be overwritten
+# Returns "skipped", "added", "changed" or "unchanged"
+def write_object_file(parent_dir, filename, template, dict, contents):
+    path = parent_dir + filename
+
+    if os.path.isfile(path):
+        if not (force_overwrite or dry_run):
+            return "skipped"
+
+        f = open(path, "r")
+        existing_values = match_template(template, f.read())
+        f.close()
+        if existing_values:
+            dict = dict.copy()
+            for key in TEMPLATE_DATE_KEYS:
+                if existing_values.get(key):
+                    dict[key] = existing_values[key]
+
+    return write_file_if_changed(path, render_template(template, dict) + contents)
+
+# file statuses that fail a dry run, "stale" files would be deleted
+OUTDATED_FILE_STATUSES = ["added", "changed", "stale"]
+
+def log_file_status(filename, status):
+    run_metrics.count("files %s" % status)
+    if dry_run:
+        if status == "added":
+            logging.warning("Missing %s" % filename)
+        elif status == "changed":
+            logging.warning("Out of date %s" % filename)
+        elif status == "stale":
+            logging.warning("Stale %s" % filename)
+    elif status == "skipped":
+        logging.info("Skipping %s..." % filename)
+    elif status == "added":
+        logging.info("Adding file %s..." % filename)
+    elif status == "changed":
+        logging.info("Overwriting %s..." % filename)
     else:
-        header_out = open(parent_dir + filename + ".h", "w")
-        logging.info("Adding file %s.h..." % filename)
+        logging.info("Unchanged %s..." % filename)
 
-    current_files.append(filename + ".h")
+# rendered object file contents (without the template) keyed by the object definition, shared
+# by every schema generated in this process
+rendered_object_cache = RunCache()
 
-    if os.path.isfile(parent_dir + filename + ".m"):
-        if not force_overwrite:
-            logging.info("Skipping %s.m..." % filename)
-            body_out = open(os.devnull, 'w')
-        else:
-            logging.info("Overwriting %s.m..." % filename)
-            body_out = open(parent_dir + filename + ".m", "w")
-    else:
-        body_out = open(parent_dir + filename + ".m", "w")
-        logging.info("Adding file %s.m..." % filename)
+# renders the .h and .m contents of an object that follow the template
+# The cache is keyed by the definition_key of the object, so that identical definitions share
+# their contents even when they are distinct instances, such as objects loaded from a schema cache
+# Returns (header_contents, body_contents)
+def render_object_files(obj):
+    if obj.definition_key in rendered_object_cache:
+        return rendered_object_cache[obj.definition_key]
 
-    current_files.append(filename + ".m")
+    class_name = obj.class_name
+    base_object = "NSManagedObject" if obj.is_cached else "NSObject"
+    statement = "@dynamic" if obj.is_cached else "@synthesize"
 
-    template_dir = os.path.dirname(os.path.realpath(__file__)) + "/"
-    template_file = "manticom.h.template"
+    header_out = StringIO.StringIO()
+    body_out = StringIO.StringIO()
 
-    # write the header
+    filename = titlecase(class_name)
 
-    # define variable names to replace in the template file
-    # if variable names are in the template and not listed here, they won't be replaced
-    dict = {"viewName" : class_name,
-            "projectName" : get_project_name_from_dir(),
-            "date" : date.today().isoformat(),
-            "year" : date.today().year,
-            "extension" : "h" }
+    # write the header
 
-    header_out.write(replace_from_template(template_dir + template_file, dict))
     header_out.write("#import <Foundation/Foundation.h>\n")
-    for (variable, t, is_array) in subclasses:
-        header_out.write('#import "%s.h"\n' % titlecase(t))
+    for r in obj.subclasses:
+        header_out.write('#import "%s.h"\n' % r.class_name)
     header_out.write("\n\n")
     header_out.write("@interface %s : %s\n" % ( titlecase(class_name), base_object))
     header_out.write("\n")
-    for (a, ns, cd, is_primary, is_optional) in attrs:
-        header_out.write("@property(nonatomic, retain) %s* %s;\n" % (ns, safety_name(a)))
-    for (variable, t, is_array) in subclasses:
-        if is_array:
-            header_out.write("@property(nonatomic, retain) %s* %s; // NSArray containing %s\n" % ("NSArray", safety_name(variable), titlecase(t)))
+    for a in obj.attrs:
+        header_out.write("@property(nonatomic, retain) %s* %s;\n" % (a.ns_type, a.safety_name))
+    for r in obj.subclasses:
+        if r.is_array:
+            header_out.write("@property(nonatomic, retain) %s* %s; // NSArray containing %s\n" % ("NSArray", r.safety_name, r.class_name))
         else:
-            header_out.write("@property(nonatomic, retain) %s* %s;\n" % (titlecase(t), safety_name(variable)))
+            header_out.write("@property(nonatomic, retain) %s* %s;\n" % (r.class_name, r.safety_name))
     header_out.write("\n")
     header_out.write("@end\n")
-    header_out.close()
 
     # write the body
 
-    dict = {"viewName" : class_name,
-        "projectName" : get_project_name_from_dir(),
-        "date" : date.today().isoformat(),
-        "year" : date.today().year,
-        "extension" : "m" }
-
-    body_out.write(replace_from_template(template_dir + template_file, dict))
     body_out.write('#import "%s.h"\n' % filename)
     body_out.write("\n\n")
     body_out.write("@implementation %s\n" % class_name)
     body_out.write("\n")
-    for (a, ns, cd, is_primary, is_optional) in attrs:
-        body_out.write("%s %s;\n" % (statement, safety_name(a)))
-    for (variable, t, is_array) in subclasses:
-        body_out.write("%s %s;\n" % (statement, safety_name(variable)))
+    for a in obj.attrs:
+        body_out.write("%s %s;\n" % (statement, a.safety_name))
+    for r in obj.subclasses:
+        body_out.write("%s %s;\n" % (statement, r.safety_name))
     body_out.write("\n@end\n")
-    body_out.close()
+
+    rendered_object_cache[obj.definition_key] = (header_out.getvalue(), body_out.getvalue())
+    return rendered_object_cache[obj.definition_key]
+
+# renders and writes the .h and .m files of an object
+# Returns [(filename, status), ...] without logging, so that callers running several
+# objects concurrently can log in a deterministic order
+def create_object_files(parent_dir, obj):
+    (header_contents, body_contents) = render_object_files(obj)
+
+    class_name = obj.class_name
+    filename = titlecase(class_name)
+    current_files = []
+
+    template = compile_template(template_dir + template_file)
+
+    # define variable names to replace in the template file
+    # if variable names are in the template and not listed here, they won't be replaced
+    dict = get_template_values().copy()
+    dict["viewName"] = class_name
+    dict["extension"] = "h"
+
+    current_files.append((filename + ".h", write_object_file(parent_dir, filename + ".h", template, dict, header_contents)))
+
+    dict["extension"] = "m"
+
+    current_files.append((filename + ".m", write_object_file(parent_dir, filename + ".m", template, dict, body_contents)))
 
     return current_files
 
+# Core Data model of the cached objects, written to
+# Machine/MachineDataModel.xcdatamodeld/MachineDataModel.xcdatamodel/contents
+CORE_DATA_MODEL_PATH = "MachineDataModel.xcdatamodeld/MachineDataModel.xcdatamodel/contents"
+
+# Writes the contents of a Core Data model with an entity per cached object. Primary attributes
+# are indexed since RestKit fetches existing objects by their identificationAttributes, and
+# the `#indexes` of an object become compound indexes.
+# Returns the number of entities
+def print_core_data_model(objects, outfile):
+    entities = OrderedDict([(d.var_name, d) for d in objects if d.is_cached])
+
+    outfile.write('''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<model name="" userDefinedModelVersionIdentifier="" type="com.apple.IDECoreDataModeler.DataModel" documentVersion="1.0" minimumToolsVersion="Xcode 4.3" macOSVersion="Automatic" iOSVersion="Automatic">
+''')
+    for d in entities.values():
+        outfile.write('    <entity name=%s representedClassName=%s syncable="YES">\n' % (quoteattr(d.class_name), quoteattr(d.class_name)))
+        for a in d.attrs:
+            outfile.write('        <attribute name=%s' % quoteattr(a.safety_name))
+            if a.is_optional:
+                outfile.write(' optional="YES"')
+            outfile.write(' attributeType=%s' % quoteattr(CORE_DATA_MODEL_TYPES[a.cd_type]))
+            if a.is_primary:
+                outfile.write(' indexed="YES"')
+            outfile.write(' syncable="YES"/>\n')
+        for r in d.subclasses:
+            if not r.object_name in entities:
+                logging.warning("The relationship `%s` of the cached object `%s` refers to `%s`, which isn't cached" % (r.name, d.var_name, r.object_name))
+                continue
+            outfile.write('        <relationship name=%s optional="YES"' % quoteattr(r.safety_name))
+            if r.is_array:
+                outfile.write(' toMany="YES"')
+            else:
+                outfile.write(' maxCount="1"')
+            outfile.write(' deletionRule="Nullify" destinationEntity=%s syncable="YES"/>\n' % quoteattr(r.class_name))
+        if d.fetch_indexes:
+            safety_names = dict([(a.name, a.safety_name) for a in d.attrs])
+            outfile.write('        <compoundIndexes>\n')
+            for index in d.fetch_indexes:
+                outfile.write('            <compoundIndex>\n')
+                for name in index:
+                    outfile.write('                <index value=%s/>\n' % quoteattr(safety_names[name]))
+                outfile.write('            </compoundIndex>\n')
+            outfile.write('        </compoundIndexes>\n')
+        outfile.write('    </entity>\n')
+    outfile.write('</model>\n')
+
+    run_metrics.count("entities", len(entities))
+    return len(entities)
+
 # Input schema:
 # {
 #   "#meta":"cached",
+#   "#indexes":["key3,key2"],
 #   "key1" :"integer,optional",
 #   "key2":"string,primary",
 #   "key3":"integer",
@@ -405,25 +806,78 @@ def create_object_files(parent_dir, class_name, attrs, subclasses, is_cached):
 #   "key5":"array,$someObject"
 # }
 
-def parse_object_mapping(var_name, obj, completed_objects):
-    class_name = titlecase(var_name)
+class Attribute(object):
+    """
+    A primitive attribute of an object definition, with its derived names computed once
+    """
+    __slots__ = ("name", "ns_type", "cd_type", "is_primary", "is_optional", "safety_name", "parameter_names")
+
+    def __init__(self, name, ns_type, cd_type, is_primary, is_optional):
+        self.name = name
+        self.ns_type = ns_type
+        self.cd_type = cd_type
+        self.is_primary = is_primary
+        self.is_optional = is_optional
+        self.safety_name = safety_name(name)
+        # indexed by the toggle state of a method signature: first parameter, other parameters
+        self.parameter_names = (parameter_name(name, False), parameter_name(name, True))
+
+class Relationship(object):
+    """
+    An attribute referencing another object definition, optionally as an array
+    """
+    __slots__ = ("name", "object_name", "is_array", "class_name", "safety_name", "parameter_names")
+
+    def __init__(self, name, object_name, is_array):
+        self.name = name
+        self.object_name = object_name
+        self.is_array = is_array
+        self.class_name = titlecase(object_name)
+        self.safety_name = safety_name(name)
+        self.parameter_names = (parameter_name(name, False), parameter_name(name, True))
+
+class ObjectDef(object):
+    """
+    An expanded object definition. attrs and subclasses are tuples of Attribute and
+    Relationship, primary_key is the first primary attribute or None. fetch_indexes are the
+    compound indexes of a cached object, as tuples of attribute names. definition_key is equal
+    for objects parsed from the same name and definition, see parse_object_definition.
+    """
+    __slots__ = ("var_name", "class_name", "attrs", "subclasses", "is_cached", "primary_attrs", "primary_key", "has_relationships", "fetch_indexes", "definition_key")
+
+    def __init__(self, var_name, attrs, subclasses, is_cached, fetch_indexes=(), definition_key=None):
+        self.var_name = var_name
+        self.class_name = titlecase(var_name)
+        self.attrs = tuple(attrs)
+        self.subclasses = tuple(subclasses)
+        self.is_cached = is_cached
+        self.primary_attrs = tuple([a for a in self.attrs if a.is_primary])
+        self.primary_key = self.primary_attrs[0] if self.primary_attrs else None
+        self.has_relationships = len(self.subclasses) > 0
+        self.fetch_indexes = tuple(fetch_indexes)
+        self.definition_key = definition_key
+
+# keys of an object definition that aren't attributes
+OBJECT_META_KEYS = frozenset(["#meta", "#indexes"])
+
+def parse_object_mapping(var_name, obj, definition_key=None):
     attrs = []
     subclasses = []
-    
-    obj = obj.copy()
 
     is_cached = False
     if "#meta" in obj:
         tags = obj["#meta"].split(",")
         is_cached = "cached" in tags
-        tags.remove("cached")
+        if is_cached:
+            tags.remove("cached")
 
         if len(tags) > 0:
             logging.warning("Don't understand the meta tag %s for variable %s" % (pformat(tags), var_name))
 
-        obj.pop("#meta")
-
     for variable in obj.keys():
+        if variable in OBJECT_META_KEYS:
+            continue
+
         attr_type = obj[variable].split(",")
         is_optional = False
         is_primary = False
@@ -458,24 +912,41 @@ def parse_object_mapping(var_name, obj, completed_objects):
                 ns_string = "NSArray"
                 cd_string = "NSUndefinedAttributeType"
             
-            attrs.append((variable, ns_string, cd_string, is_primary, is_optional))
+            attrs.append(Attribute(variable, ns_string, cd_string, is_primary, is_optional))
         else:
-            if not data_type in completed_objects:
-                logging.error("Incomplete reference %s to %s " % (variable, data_type))
-
             if is_primary:
                 logging.error("Object data type `%s` on `%s` cannot have the `primary` attribute " % (variable, var_name))
 
             if is_optional:
                 logging.error("Object data type `%s` on `%s` cannot have the `optional` attribute " % (variable, var_name))
 
-            subclasses.append((variable, data_type[1:], is_array))
+            subclasses.append(Relationship(variable, data_type[1:], is_array))
+
+    return ObjectDef(var_name, attrs, subclasses, is_cached, parse_fetch_indexes(var_name, obj, attrs, is_cached), definition_key)
 
-    return { "var_name" : var_name,
-             "class_name" : class_name,
-             "attrs" : attrs,
-             "subclasses" : subclasses,
-             "is_cached" : is_cached}
+# parses the compound fetch indexes of an object, each index lists attribute names:
+#   "#indexes" : ["last_name,first_name", "date_joined"]
+def parse_fetch_indexes(var_name, obj, attrs, is_cached):
+    if not "#indexes" in obj:
+        return []
+
+    if not isinstance(obj["#indexes"], list):
+        logging.error("The `#indexes` of `%s` must be a list" % var_name)
+        return []
+
+    if not is_cached:
+        logging.warning("The `#indexes` of `%s` are ignored, only cached objects are stored in Core Data" % var_name)
+
+    names = set([a.name for a in attrs])
+    indexes = []
+    for index in obj["#indexes"]:
+        index = tuple(index.split(","))
+        missing = [name for name in index if not name in names]
+        if missing:
+            logging.error("The index `%s` of `%s` refers to unknown attributes %s" % (",".join(index), var_name, ", ".join(missing)))
+        else:
+            indexes.append(index)
+    return indexes
 
 def print_auth_type(outfile, auth_type):
     closing_line = "} else { \n[sharedMgr.HTTPClient clearAuthorizationHeader];\n}\n"
@@ -503,36 +974,25 @@ def print_auth_type(outfile, auth_type):
 def print_parameter_dict(outfile, param):
     if len(param):
         outfile.write("NSMutableDictionary* paramDict = [NSMutableDictionary dictionaryWithCapacity:%d];\n" % len(param))
-        for (var, ns, cd, is_primary, is_optional) in param:
-            outfile.write("if (%s) {\n" % safety_name(var))
-            outfile.write('[paramDict setObject:%s forKey:@"%s"];\n' % (safety_name(var), var))
+        for a in param:
+            outfile.write("if (%s) {\n" % a.safety_name)
+            outfile.write('[paramDict setObject:%s forKey:@"%s"];\n' % (a.safety_name, a.name))
             outfile.write("}\n")
 
         return "paramDict"
     else:
         return "nil"
 
-# finds and returns the first primary key for a resource, assume only one primary key is allowed
-def get_primary_key_from_params(attrs):
-    if not attrs:
-        return (None, None, None)
-
-    for (var, ns, cd, is_primary, is_optional) in attrs:
-        if is_primary:
-            return (var, ns, cd)
-    return (None, None, None)
-
 # adds the @"" to a url if primary key is created, so the variable name is returned
-# primary_payload = get_primary_key_from_params(...)
+# primary_key is the Attribute used as primary key or None
 # method is used for debugging assistance only
-def get_decorated_url_with_primary_key(outfile, url, primary_payload, method = ""):
-    (primary_key, ns, cd) = primary_payload # unpack the output from get_primary_key_from_params()
+def get_decorated_url_with_primary_key(outfile, url, primary_key, method = ""):
     if primary_key:
-        if url.find(":%s" % primary_key) == -1 and method != "delete":
-            logging.warn("URL `%s` should contain the primary key `:%s` for proper RestKit mapping" % (url, primary_key))
-        url = url.replace(":%s" % primary_key, "") # automatically remove `:primary_key` from the URL
+        if url.find(":%s" % primary_key.name) == -1 and method != "delete":
+            logging.warn("URL `%s` should contain the primary key `:%s` for proper RestKit mapping" % (url, primary_key.name))
+        url = url.replace(":%s" % primary_key.name, "") # automatically remove `:primary_key` from the URL
         url = url.rstrip('/') # and extra trailing backslashes
-        outfile.write('NSString* fullUrl = [NSString stringWithFormat:@"%s/%s/", %s];\n' % (url, "%@", safety_name(primary_key)))
+        outfile.write('NSString* fullUrl = [NSString stringWithFormat:@"%s/%s/", %s];\n' % (url, "%@", primary_key.safety_name))
         return "fullUrl"
     else:
         if url != "nil":
@@ -543,20 +1003,28 @@ def get_decorated_url_with_primary_key(outfile, url, primary_payload, method = "
 
         return url
 
-# prototype_attrs can be None or an array of attributes
-def print_get_method(url, outfile, var_name, class_name, prototype_attrs, param, is_header, auth_type):
-    outfile.write("-(void) getAll%sWith" % underscore_to_camel(url))
+# writes the `name:(Type*)variable ` part of a method signature for an Attribute or Relationship
+def print_signature_parameter(outfile, a, ns_type, toggle_state):
+    outfile.write("%s:(%s*)%s " % (a.parameter_names[toggle_state], ns_type, a.safety_name))
+
+# prototype can be None or an ObjectDef
+# url_name is the url in the selector, see resolve_endpoints
+# prelude is code run first in the body of the method
+# conditional revalidates the last result of the same url and parameters, see print_conditional_get
+# coalesced shares the request of an identical call in flight, see print_coalesced_callbacks
+def print_get_method(url, url_name, outfile, var_name, class_name, prototype, param, is_header, auth_type, prelude="", conditional=False, coalesced=False):
+    outfile.write("-(void) getAll%sWith" % url_name)
 
     # print primary key, no other attributes are output
     toggle_state = False
-    (primary_key, ns, cd) = get_primary_key_from_params(prototype_attrs)
+    primary_key = prototype.primary_key if prototype else None
     if primary_key:
-        outfile.write("%s:(%s*)%s " % (parameter_name(primary_key, toggle_state), ns, safety_name(primary_key)))
+        print_signature_parameter(outfile, primary_key, primary_key.ns_type, toggle_state)
         toggle_state = True
 
 
-    for (var, ns, cd, is_primary, is_optional) in param:
-        outfile.write("%s:(%s*)%s " % (parameter_name(var, toggle_state), ns, safety_name(var)))
+    for a in param:
+        print_signature_parameter(outfile, a, a.ns_type, toggle_state)
         toggle_state = True
 
     if not toggle_state:
@@ -569,34 +1037,296 @@ def print_get_method(url, outfile, var_name, class_name, prototype_attrs, param,
         outfile.write(";\n\n")
     else:
         outfile.write(" {\n")
+        outfile.write(prelude)
         outfile.write("RKObjectManager* sharedMgr = [RKObjectManager sharedManager];\n")
         param_dict = print_parameter_dict(outfile, param)
         print_auth_type(outfile, auth_type)
 
-        url = get_decorated_url_with_primary_key(outfile, url, get_primary_key_from_params(prototype_attrs), "get")
+        url = get_decorated_url_with_primary_key(outfile, url, primary_key, "get")
         
-        outfile.write('[sharedMgr getObjectsAtPath:%s parameters:%s success:success failure:failure];\n' % (url, param_dict))
+        if coalesced:
+            print_coalesced_callbacks(outfile, url, param_dict)
+        if conditional:
+            print_conditional_get(outfile, url, param_dict)
+        else:
+            outfile.write('[sharedMgr getObjectsAtPath:%s parameters:%s success:success failure:failure];\n' % (url, param_dict))
         outfile.write('}\n\n')
 
-# attrs are used to identify the primary key, they aren't printed
+# Writes the code joining a call to the identical request in flight, keyed by url and parameters.
+# The first call makes the request, success and failure are replaced so that its result is passed
+# to every call waiting for it.
+def print_coalesced_callbacks(outfile, url, param_dict):
+    outfile.write('''static NSMutableDictionary* pendingRequests = nil;
+static dispatch_once_t pendingOnceToken;
+dispatch_once(&pendingOnceToken, ^{
+    pendingRequests = [NSMutableDictionary new];
+});
+NSString* requestKey = [NSString stringWithFormat:@"GET %%@ %%@", %(url)s, %(params)s];
+void (^callback)(RKObjectRequestOperation*, RKMappingResult*, NSError*) = ^(RKObjectRequestOperation *operation, RKMappingResult *mappingResult, NSError *error) {
+    if (error) {
+        if (failure) {
+            failure(operation, error);
+        }
+    } else if (success) {
+        success(operation, mappingResult);
+    }
+};
+NSMutableArray* waiting = [pendingRequests objectForKey:requestKey];
+if (waiting) {
+    [waiting addObject:callback];
+    return;
+}
+[pendingRequests setObject:[NSMutableArray arrayWithObject:callback] forKey:requestKey];
+success = ^(RKObjectRequestOperation *operation, RKMappingResult *mappingResult) {
+    NSArray* callbacks = [pendingRequests objectForKey:requestKey];
+    [pendingRequests removeObjectForKey:requestKey];
+    for (void (^waitingCallback)(RKObjectRequestOperation*, RKMappingResult*, NSError*) in callbacks) {
+        waitingCallback(operation, mappingResult, nil);
+    }
+};
+failure = ^(RKObjectRequestOperation *operation, NSError *error) {
+    NSArray* callbacks = [pendingRequests objectForKey:requestKey];
+    [pendingRequests removeObjectForKey:requestKey];
+    for (void (^waitingCallback)(RKObjectRequestOperation*, RKMappingResult*, NSError*) in callbacks) {
+        waitingCallback(operation, nil, error);
+    }
+};
+''' % { "url" : url, "params" : param_dict })
+
+# Writes a get sending the validators of the last result of the same url and parameters. On a
+# 304 Not Modified the last result is passed to success again instead of mapping a new one.
+# The validators are set on the request of this call only, the default headers of the shared
+# HTTP client would be sent by every request running meanwhile.
+def print_conditional_get(outfile, url, param_dict):
+    outfile.write('''static NSMutableDictionary* validatedResults = nil;
+static dispatch_once_t onceToken;
+dispatch_once(&onceToken, ^{
+    validatedResults = [NSMutableDictionary new];
+});
+NSString* resultKey = [NSString stringWithFormat:@"%%@ %%@", %(url)s, %(params)s];
+NSDictionary* validated = [validatedResults objectForKey:resultKey];
+NSMutableURLRequest* request = [sharedMgr requestWithObject:nil method:RKRequestMethodGET path:%(url)s parameters:%(params)s];
+[request setValue:[validated objectForKey:@"ETag"] forHTTPHeaderField:@"If-None-Match"];
+[request setValue:[validated objectForKey:@"Last-Modified"] forHTTPHeaderField:@"If-Modified-Since"];
+RKObjectRequestOperation* operation = [sharedMgr managedObjectRequestOperationWithRequest:request managedObjectContext:sharedMgr.managedObjectStore.mainQueueManagedObjectContext success:^(RKObjectRequestOperation *operation, RKMappingResult *mappingResult) {
+    NSHTTPURLResponse* response = operation.HTTPRequestOperation.response;
+    if (response.statusCode == 304 && validated) {
+        success(operation, [validated objectForKey:@"result"]);
+        return;
+    }
+    NSMutableDictionary* result = [NSMutableDictionary dictionaryWithObject:mappingResult forKey:@"result"];
+    for (NSString* header in response.allHeaderFields) {
+        if ([header caseInsensitiveCompare:@"ETag"] == NSOrderedSame) {
+            [result setObject:[response.allHeaderFields objectForKey:header] forKey:@"ETag"];
+        } else if ([header caseInsensitiveCompare:@"Last-Modified"] == NSOrderedSame) {
+            [result setObject:[response.allHeaderFields objectForKey:header] forKey:@"Last-Modified"];
+        }
+    }
+    [validatedResults setObject:result forKey:resultKey];
+    success(operation, mappingResult);
+} failure:^(RKObjectRequestOperation *operation, NSError *error) {
+    if (operation.HTTPRequestOperation.response.statusCode == 304 && validated) {
+        success(operation, [validated objectForKey:@"result"]);
+    } else {
+        failure(operation, error);
+    }
+}];
+[sharedMgr enqueueObjectRequestOperation:operation];
+''' % { "url" : url, "params" : param_dict })
+
+# offset and limit of a page, appended to the parameters of a paginated get. They replace
+# parameters of the get with the same names.
+PAGE_PARAMETERS = (Attribute("offset", "NSNumber", "NSInteger32AttributeType", False, True),
+                   Attribute("limit", "NSNumber", "NSInteger32AttributeType", False, True))
+PAGE_PARAMETER_NAMES = frozenset([a.name for a in PAGE_PARAMETERS])
+
+RESULT_CALLBACKS = ":(void (^)(RKObjectRequestOperation *operation, RKMappingResult *mappingResult))success failure:(void (^)(RKObjectRequestOperation *operation, NSError *error))failure"
+
+# Writes get<Url>PageWith...offset:limit:, fetching a page of the collection, and
+# getNext<Url>PageWith...pageResult:, fetching the page following a mapping result. getNext
+# returns NO after the last page. pagination is the 'pagination' of the operation, see
+# resolve_endpoints
+def print_page_methods(url, url_name, outfile, prototype, param, is_header, auth_type, pagination, prelude=""):
+    primary_key = prototype.primary_key if prototype else None
+    param = tuple([a for a in param if not a.name in PAGE_PARAMETER_NAMES])
+    arguments = ((primary_key,) if primary_key else ()) + param
+
+    if is_header:
+        outfile.write("// %d objects per page unless a limit is given\n" % pagination["page_size"])
+    outfile.write("-(void) get%sPageWith" % url_name)
+    for (i, a) in enumerate(arguments + PAGE_PARAMETERS):
+        print_signature_parameter(outfile, a, a.ns_type, i > 0)
+    outfile.write("success" + RESULT_CALLBACKS)
+    if is_header:
+        outfile.write(";\n\n")
+    else:
+        outfile.write(" {\n")
+        outfile.write(prelude)
+        outfile.write("RKObjectManager* sharedMgr = [RKObjectManager sharedManager];\n")
+        outfile.write("if (!offset) {\noffset = @0;\n}\n")
+        outfile.write("if (!limit) {\nlimit = @%d;\n}\n" % pagination["page_size"])
+        param_dict = print_parameter_dict(outfile, param + PAGE_PARAMETERS)
+        print_auth_type(outfile, auth_type)
+
+        url = get_decorated_url_with_primary_key(outfile, url, primary_key, "get")
+
+        if not pagination["prefetch"]:
+            outfile.write('[sharedMgr getObjectsAtPath:%s parameters:%s success:success failure:failure];\n' % (url, param_dict))
+        else:
+            # the next page is mapped once a page is delivered and kept until it is asked for
+            outfile.write('''static NSMutableDictionary* prefetchedPages = nil;
+static dispatch_once_t onceToken;
+dispatch_once(&onceToken, ^{
+    prefetchedPages = [NSMutableDictionary new];
+});
+void (^prefetchNextPage)(RKMappingResult*) = ^(RKMappingResult* deliveredPage) {
+    if (![[deliveredPage.dictionary objectForKey:%(meta)s] valueForKey:@"next"]) {
+        return;
+    }
+    NSMutableDictionary* nextParamDict = [%(params)s mutableCopy];
+    [nextParamDict setObject:@([offset integerValue] + [limit integerValue]) forKey:@"offset"];
+    NSString* nextPageKey = [NSString stringWithFormat:@"%%@ %%@", %(url)s, nextParamDict];
+    [sharedMgr getObjectsAtPath:%(url)s parameters:nextParamDict success:^(RKObjectRequestOperation *operation, RKMappingResult *mappingResult) {
+        [prefetchedPages setObject:mappingResult forKey:nextPageKey];
+    } failure:nil];
+};
+NSString* pageKey = [NSString stringWithFormat:@"%%@ %%@", %(url)s, %(params)s];
+RKMappingResult* prefetchedPage = [prefetchedPages objectForKey:pageKey];
+if (prefetchedPage) {
+    [prefetchedPages removeObjectForKey:pageKey];
+    success(nil, prefetchedPage);
+    prefetchNextPage(prefetchedPage);
+    return;
+}
+[sharedMgr getObjectsAtPath:%(url)s parameters:%(params)s success:^(RKObjectRequestOperation *operation, RKMappingResult *mappingResult) {
+    success(operation, mappingResult);
+    prefetchNextPage(mappingResult);
+} failure:failure];
+''' % { "meta" : pagination["meta_key_path"], "url" : url, "params" : param_dict })
+        outfile.write('}\n\n')
+
+    outfile.write("-(BOOL) getNext%sPageWith" % url_name)
+    for (i, a) in enumerate(arguments):
+        print_signature_parameter(outfile, a, a.ns_type, i > 0)
+    outfile.write("%s:(RKMappingResult*)pageResult success" % first_other("PageResult", "pageResult", len(arguments) > 0))
+    outfile.write(RESULT_CALLBACKS)
+    if is_header:
+        outfile.write(";\n\n")
+    else:
+        outfile.write(" {\n")
+        outfile.write("id pageMeta = [pageResult.dictionary objectForKey:%s];\n" % pagination["meta_key_path"])
+        outfile.write("if (![pageMeta valueForKey:@\"next\"]) {\nreturn NO;\n}\n")
+        outfile.write("NSNumber* limit = [pageMeta valueForKey:@\"limit\"];\n")
+        outfile.write("NSNumber* offset = @([[pageMeta valueForKey:@\"offset\"] integerValue] + [limit integerValue]);\n")
+        outfile.write("[self get%sPageWith" % url_name)
+        for (i, a) in enumerate(arguments + PAGE_PARAMETERS):
+            outfile.write("%s:%s " % (a.parameter_names[i > 0], a.safety_name))
+        outfile.write("success:success failure:failure];\n")
+        outfile.write("return YES;\n}\n\n")
+
+# Writes getAll<Url>With...fields:expand:, asking for a subset of the fields of the response
+# objects. fields and expand are json keys sent comma separated in the query parameters named by
+# sparse, see parse_sparse. The response is mapped with copies of the GET response descriptors of
+# the url whose mappings of class_name only keep those keys and the identification attributes.
+# The reduced descriptors are built once per field subset.
+def print_sparse_get_method(url, url_name, outfile, class_name, prototype, param, is_header, auth_type, sparse, prelude=""):
+    outfile.write("-(void) getAll%sWith" % url_name)
+
+    toggle_state = False
+    primary_key = prototype.primary_key if prototype else None
+    if primary_key:
+        print_signature_parameter(outfile, primary_key, primary_key.ns_type, toggle_state)
+        toggle_state = True
+    for a in param:
+        print_signature_parameter(outfile, a, a.ns_type, toggle_state)
+        toggle_state = True
+    outfile.write("%s:(NSArray*)fields " % first_other("Fields", "fields", toggle_state))
+    if sparse["expand"]:
+        outfile.write("expand:(NSArray*)expand ")
+    outfile.write("success" + RESULT_CALLBACKS)
+
+    if is_header:
+        outfile.write(";\n\n")
+        return
+
+    outfile.write(" {\n")
+    outfile.write(prelude)
+    outfile.write("RKObjectManager* sharedMgr = [RKObjectManager sharedManager];\n")
+    param_dict = print_parameter_dict(outfile, param)
+    if param_dict != "nil":
+        outfile.write("NSMutableDictionary* sparseParamDict = [NSMutableDictionary dictionaryWithDictionary:%s];\n" % param_dict)
+    else:
+        outfile.write("NSMutableDictionary* sparseParamDict = [NSMutableDictionary dictionary];\n")
+    outfile.write("if (fields) {\n")
+    outfile.write('[sparseParamDict setObject:[fields componentsJoinedByString:@","] forKey:@"%s"];\n' % sparse["fields"])
+    outfile.write("}\n")
+    if sparse["expand"]:
+        outfile.write("if (expand) {\n")
+        outfile.write('[sparseParamDict setObject:[expand componentsJoinedByString:@","] forKey:@"%s"];\n' % sparse["expand"])
+        outfile.write("}\n")
+    else:
+        outfile.write("NSArray* expand = nil;\n")
+    print_auth_type(outfile, auth_type)
+
+    url = get_decorated_url_with_primary_key(outfile, url, primary_key, "get")
+
+    outfile.write('''static NSMutableDictionary* reducedDescriptors = nil;
+static dispatch_once_t onceToken;
+dispatch_once(&onceToken, ^{
+    reducedDescriptors = [NSMutableDictionary new];
+});
+NSString* descriptorsKey = [NSString stringWithFormat:@"%%@ %%@", fields, expand];
+NSArray* descriptors = [reducedDescriptors objectForKey:descriptorsKey];
+if (!descriptors) {
+    NSMutableArray* reduced = [NSMutableArray array];
+    for (RKResponseDescriptor* descriptor in sharedMgr.responseDescriptors) {
+        if ((descriptor.pathPattern && !(descriptor.method & RKRequestMethodGET)) || ![descriptor matchesPath:%(url)s]) {
+            continue;
+        }
+        if (!fields || ![descriptor.mapping isKindOfClass:[RKObjectMapping class]] || ((RKObjectMapping*)descriptor.mapping).objectClass != [%(class_name)s class]) {
+            [reduced addObject:descriptor];
+            continue;
+        }
+        RKObjectMapping* mapping = [(RKObjectMapping*)descriptor.mapping copy];
+        NSArray* identification = [mapping isKindOfClass:[RKEntityMapping class]] ? [[(RKEntityMapping*)mapping identificationAttributes] valueForKey:@"name"] : @[];
+        for (RKPropertyMapping* propertyMapping in [mapping.propertyMappings copy]) {
+            if (![fields containsObject:propertyMapping.sourceKeyPath] && ![expand containsObject:propertyMapping.sourceKeyPath] && ![identification containsObject:propertyMapping.destinationKeyPath]) {
+                [mapping removePropertyMapping:propertyMapping];
+            }
+        }
+        [reduced addObject:[RKResponseDescriptor responseDescriptorWithMapping:mapping method:descriptor.method pathPattern:descriptor.pathPattern keyPath:descriptor.keyPath statusCodes:descriptor.statusCodes]];
+    }
+    descriptors = reduced;
+    [reducedDescriptors setObject:descriptors forKey:descriptorsKey];
+}
+NSMutableURLRequest* request = [sharedMgr requestWithObject:nil method:RKRequestMethodGET path:%(url)s parameters:sparseParamDict];
+RKManagedObjectRequestOperation* operation = [[RKManagedObjectRequestOperation alloc] initWithRequest:request responseDescriptors:descriptors];
+operation.managedObjectContext = sharedMgr.managedObjectStore.mainQueueManagedObjectContext;
+operation.managedObjectCache = sharedMgr.managedObjectStore.managedObjectCache;
+[operation setCompletionBlockWithSuccess:success failure:failure];
+[sharedMgr enqueueObjectRequestOperation:operation];
+}
+
+''' % { "url" : url, "class_name" : class_name })
+
+# the prototype is used to identify the primary key, its attributes aren't printed
 # all parameters are printed
-def print_delete_method(url, outfile, prototype_attrs, param, is_header, auth_type):
-    outfile.write("-(void) delete%sWith" % underscore_to_camel(url))
+def print_delete_method(url, url_name, outfile, prototype, param, is_header, auth_type, prelude=""):
+    outfile.write("-(void) delete%sWith" % url_name)
 
     # print primary key, no other attributes are output
     toggle_state = False
-    (primary_key, ns, cd) = get_primary_key_from_params(prototype_attrs)
+    primary_key = prototype.primary_key if prototype else None
     if primary_key:
-        outfile.write("%s:(%s*)%s " % (parameter_name(primary_key, toggle_state), ns, safety_name(primary_key)))
+        print_signature_parameter(outfile, primary_key, primary_key.ns_type, toggle_state)
         toggle_state = True
     else:
         # delete always has to print out a primary key
-        primary_key = "PRIMARY_KEY"
         logging.warn("No PRIMARY_KEY specified for delete `%s`" % url)
 
     # print all parameters
-    for (var, ns, cd, is_primary, is_optional) in param:
-        outfile.write("%s:(%s*)%s " % (parameter_name(var, toggle_state), ns, safety_name(var)))
+    for a in param:
+        print_signature_parameter(outfile, a, a.ns_type, toggle_state)
         toggle_state = True
 
 
@@ -610,47 +1340,49 @@ def print_delete_method(url, outfile, prototype_attrs, param, is_header, auth_ty
         outfile.write(";\n\n")
     else:
         outfile.write(" {\n")
+        outfile.write(prelude)
         outfile.write("RKObjectManager* sharedMgr = [RKObjectManager sharedManager];\n")
 
         param_dict = print_parameter_dict(outfile, param)
 
         print_auth_type(outfile, auth_type)
 
-        url = get_decorated_url_with_primary_key(outfile, url, get_primary_key_from_params(prototype_attrs), "delete")
+        url = get_decorated_url_with_primary_key(outfile, url, primary_key, "delete")
 
         outfile.write('[sharedMgr deleteObject:nil path:%s parameters:%s success:success failure:failure];\n' % (url, param_dict))
         outfile.write('}\n\n')    
 
 
-def print_access_method(method, url, var_name, class_name, attrs, prototype_attrs, subclasses, param, is_header, outfile, auth_type):
+# obj is the ObjectDef of the request, prototype can be None or an ObjectDef
+def print_access_method(method, url, url_name, obj, prototype, param, is_header, outfile, auth_type, prelude=""):
     toggle_state = False
-    outfile.write("-(void) %s%sWith" % (method, underscore_to_camel(url)))
+    outfile.write("-(void) %s%sWith" % (method, url_name))
 
     # choose between prototype primary key or request primary key, whichever is provided
-    (primary_key, ns, cd) = get_primary_key_from_params(prototype_attrs)
+    primary_key = prototype.primary_key if prototype else None
     if not primary_key:
-        (primary_key, ns, cd) = get_primary_key_from_params(attrs)
+        primary_key = obj.primary_key
 
     # write the primary key first
     if primary_key:
-        outfile.write("%s:(%s*)%s " % (parameter_name(primary_key, toggle_state), ns, safety_name(primary_key)))
+        print_signature_parameter(outfile, primary_key, primary_key.ns_type, toggle_state)
         toggle_state = True
 
     # write other attributes
-    for (var, ns, cd, is_primary, is_optional) in attrs:
-        if not is_primary:
-            outfile.write("%s:(%s*)%s " % (parameter_name(var, toggle_state), ns, safety_name(var)))
+    for a in obj.attrs:
+        if not a.is_primary:
+            print_signature_parameter(outfile, a, a.ns_type, toggle_state)
             toggle_state = True    
 
     # write classes
-    for (var, ns, is_array) in subclasses:
-        outfile.write("%s:(%s*)%s " % (parameter_name(var, toggle_state), titlecase(ns), safety_name(var)))
+    for r in obj.subclasses:
+        print_signature_parameter(outfile, r, r.class_name, toggle_state)
         toggle_state = True
 
     # write additional parameters
-    for (var, ns, cd, is_primary, is_optional) in param:
-            outfile.write("%s:(%s*)%s " % (parameter_name(var, toggle_state), ns, safety_name(var)))
-            toggle_state = True
+    for a in param:
+        print_signature_parameter(outfile, a, a.ns_type, toggle_state)
+        toggle_state = True
 
     if not toggle_state:
         outfile.write("Success")
@@ -663,29 +1395,145 @@ def print_access_method(method, url, var_name, class_name, attrs, prototype_attr
         outfile.write(";\n\n")
     else:
         outfile.write(" {\n")
+        outfile.write(prelude)
         outfile.write("RKObjectManager* sharedMgr = [RKObjectManager sharedManager];\n")
-        outfile.write("%s* obj = [%s new];\n" % (class_name, class_name))
-        for (var, ns, cd, is_primary, is_optional) in attrs:
-            outfile.write("obj.%s = %s;\n" % (safety_name(var), safety_name(var)))
-        for (var, ns, is_array) in subclasses:
-            outfile.write("obj.%s = %s;\n" % (safety_name(var), safety_name(var)))
+        outfile.write("%s* obj = [%s new];\n" % (obj.class_name, obj.class_name))
+        for a in obj.attrs:
+            outfile.write("obj.%s = %s;\n" % (a.safety_name, a.safety_name))
+        for r in obj.subclasses:
+            outfile.write("obj.%s = %s;\n" % (r.safety_name, r.safety_name))
         outfile.write("\n")
 
         param_dict = print_parameter_dict(outfile, param)
 
         print_auth_type(outfile, auth_type)
 
-        # choose between prototype primary key or request primary key, whichever is provided
-        (primary_key, ns, cd) = get_primary_key_from_params(prototype_attrs)
-        if not primary_key:
-            (primary_key, ns, cd) = get_primary_key_from_params(attrs)
-
-        url = get_decorated_url_with_primary_key(outfile, url, (primary_key, ns, cd), method)
+        url = get_decorated_url_with_primary_key(outfile, url, primary_key, method)
 
         outfile.write("[sharedMgr %sObject:obj path:%s parameters:%s success:^(RKObjectRequestOperation *operation, RKMappingResult *mappingResult) {\n" % (method, url, param_dict))
         outfile.write("    success(operation, mappingResult); } \n")
         outfile.write("    failure:failure];\n}\n\n")
 
+# Tastypie list request of a bulk method: a post creates `objects`, a put replaces the collection
+# with them and a patch updates them and deletes the resource uris of `deleted_objects`
+BULK_RK_METHODS = { "post" : "RKRequestMethodPATCH",
+                    "put" : "RKRequestMethodPUT",
+                    "patch" : "RKRequestMethodPATCH" }
+
+# Writes bulk<Method><Url>With...objects:, sending an array of request objects serialized with
+# their request descriptor in one list request. bulk is the 'bulk' of the operation, with a
+# batch_size the objects are split in requests sent together, success is called once all of them
+# succeeded and failure with the first error.
+# The list request of a post is a PATCH, so the responses are mapped with the response descriptors
+# of the declared method, the manager only has PATCH descriptors when the url declares a patch.
+# obj is the ObjectDef of the request, prototype can be None or an ObjectDef
+def print_bulk_method(method, url, url_name, obj, prototype, param, is_header, outfile, auth_type, bulk, prelude=""):
+    outfile.write("-(void) bulk%s%sWith" % (titlecase(method), url_name))
+
+    primary_key = prototype.primary_key if prototype else None
+    toggle_state = False
+    if primary_key:
+        print_signature_parameter(outfile, primary_key, primary_key.ns_type, toggle_state)
+        toggle_state = True
+    for a in param:
+        print_signature_parameter(outfile, a, a.ns_type, toggle_state)
+        toggle_state = True
+    outfile.write("%s:(NSArray*)objects " % first_other("Objects", "objects", toggle_state))
+    if method == "patch":
+        outfile.write("deletedObjects:(NSArray*)deletedObjects ")
+    outfile.write("success" + RESULT_CALLBACKS)
+
+    if is_header:
+        outfile.write(";\n\n")
+        return
+
+    outfile.write(" {\n")
+    outfile.write(prelude)
+    outfile.write("RKObjectManager* sharedMgr = [RKObjectManager sharedManager];\n")
+    param_dict = print_parameter_dict(outfile, param)
+    print_auth_type(outfile, auth_type)
+
+    url = get_decorated_url_with_primary_key(outfile, url, primary_key, method)
+
+    if bulk["batch_size"]:
+        batch_size = "%d" % bulk["batch_size"]
+    else:
+        batch_size = "MAX(serialized.count, 1)"
+    if param_dict != "nil":
+        body = "[NSMutableDictionary dictionaryWithDictionary:%s]" % param_dict
+    else:
+        body = "[NSMutableDictionary dictionary]"
+
+    outfile.write('''NSMutableArray* serialized = [NSMutableArray arrayWithCapacity:objects.count];
+for (%(class_name)s* obj in objects) {
+    NSError* error = nil;
+    NSDictionary* parameters = nil;
+    for (RKRequestDescriptor* descriptor in sharedMgr.requestDescriptors) {
+        if ([descriptor matchesObject:obj]) {
+            parameters = [RKObjectParameterization parametersWithObject:obj requestDescriptor:descriptor error:&error];
+            break;
+        }
+    }
+    if (!parameters) {
+        if (!error) {
+            error = [NSError errorWithDomain:RKErrorDomain code:RKMappingErrorNotFound userInfo:@{NSLocalizedDescriptionKey : [NSString stringWithFormat:@"No request descriptor matches %%@", obj]}];
+        }
+        failure(nil, error);
+        return;
+    }
+    [serialized addObject:parameters];
+}
+NSMutableArray* responseDescriptors = [NSMutableArray array];
+for (RKResponseDescriptor* descriptor in sharedMgr.responseDescriptors) {
+    if ((!descriptor.pathPattern || (descriptor.method & %(declared_method)s)) && [descriptor matchesPath:%(url)s]) {
+        [responseDescriptors addObject:descriptor];
+    }
+}
+
+NSUInteger batchSize = %(batch_size)s;
+__block NSError* batchError = nil;
+__block RKObjectRequestOperation* lastOperation = nil;
+__block RKMappingResult* lastMappingResult = nil;
+dispatch_group_t batches = dispatch_group_create();
+for (NSUInteger start = 0; start == 0 || start < serialized.count; start += batchSize) {
+    NSMutableDictionary* body = %(body)s;
+    [body setObject:[serialized subarrayWithRange:NSMakeRange(start, MIN(batchSize, serialized.count - start))] forKey:@"objects"];
+''' % { "class_name" : obj.class_name, "batch_size" : batch_size, "body" : body,
+        "declared_method" : get_rk_method(titlecase(method)), "url" : url })
+    if method == "patch":
+        outfile.write('''    if (start == 0 && deletedObjects) {
+        [body setObject:deletedObjects forKey:@"deleted_objects"];
+    }
+''')
+    outfile.write('''    NSMutableURLRequest* request = [sharedMgr requestWithObject:nil method:%(rk_method)s path:%(url)s parameters:body];
+    RKManagedObjectRequestOperation* operation = [[RKManagedObjectRequestOperation alloc] initWithRequest:request responseDescriptors:responseDescriptors];
+    operation.managedObjectContext = sharedMgr.managedObjectStore.mainQueueManagedObjectContext;
+    operation.managedObjectCache = sharedMgr.managedObjectStore.managedObjectCache;
+    [operation setCompletionBlockWithSuccess:^(RKObjectRequestOperation *operation, RKMappingResult *mappingResult) {
+        lastOperation = operation;
+        lastMappingResult = mappingResult;
+        dispatch_group_leave(batches);
+    } failure:^(RKObjectRequestOperation *operation, NSError *error) {
+        if (!batchError) {
+            batchError = error;
+            lastOperation = operation;
+        }
+        dispatch_group_leave(batches);
+    }];
+    dispatch_group_enter(batches);
+    [sharedMgr enqueueObjectRequestOperation:operation];
+}
+dispatch_group_notify(batches, dispatch_get_main_queue(), ^{
+    if (batchError) {
+        failure(lastOperation, batchError);
+    } else {
+        success(lastOperation, lastMappingResult);
+    }
+});
+}
+
+''' % { "rk_method" : BULK_RK_METHODS[method], "url" : url })
+
 # # This method is useful for debugging only. We don't know the object graph of requests and responses until we have fulled parsed the URL mappings.
 # def parse_objects_as_responses(schema, outfile):
 #     completed_objects = [] # object names with the $ prefix
@@ -715,94 +1563,158 @@ def print_access_method(method, url, var_name, class_name, attrs, prototype_attr
     #     "email": "string"
     # }
 # TODO : match the input and output schemas rf
-# Output schema example (expanded objects):
+# Output schema example (expanded objects), a list of ObjectDef:
 # [
-# {'class_name': u'ChangePasswordRequest', 
-#   'is_cached': False,
-#   'var_name': u'changePasswordRequest',
-#   'subclasses': [(u'related_tags', u'tag',True), (u'user_profile', u'userProfileResponse',False)], 
-#   'attrs': [(u'new_password', 'NSString', 'NSStringAttributeType', False, False),
-#             (u'old_password', 'NSString', 'NSStringAttributeType', False, False)]
-# },
-# {'class_name': u'SignupRequest', 
-#    'is_cached': False,
-#    'var_name': u'signupRequest',
-#   ... 
-# }
+# ObjectDef(var_name=u'changePasswordRequest', class_name=u'ChangePasswordRequest', is_cached=False,
+#           attrs=(Attribute(name=u'new_password', ns_type='NSString', cd_type='NSStringAttributeType', is_primary=False, is_optional=False),
+#                  Attribute(name=u'old_password', ns_type='NSString', cd_type='NSStringAttributeType', is_primary=False, is_optional=False)),
+#           subclasses=(Relationship(name=u'related_tags', object_name=u'tag', is_array=True),
+#                       Relationship(name=u'user_profile', object_name=u'userProfileResponse', is_array=False)),
+#           fetch_indexes=()),
+# ObjectDef(var_name=u'signupRequest', class_name=u'SignupRequest', is_cached=False,
+#   ...
+# )
 # ]
-def parse_all_objects(schema):
-    completed_objects = [] # object names with the $ prefix
-    request_objects = []
+#
+# Expanded objects are cached by name and definition content until a watch run stops using them,
+# so schemas sharing object definitions (see generate_batch) only parse them once. Cached
+# objects are shared between schemas and must not be modified. The warnings and errors logged
+# while parsing an object are cached with it and logged again whenever it is reused.
+parsed_object_cache = RunCache()
+
+# parses a single entry of `objects` into request_objects
+# completed_objects holds the object names (with the $ prefix) parsed so far
+def parse_object_definition(el, request_objects, completed_objects):
+    if len(el.keys()) != 1:
+        logging.error("Mapping a key in `objects` should contain a single object only")
+
+    for key in el.keys():
+        obj = el[key]
+
+        if key[0:1] != "$":
+            logging.error("Not an object definition in the format $defName: %s" % key)
+            continue
+
+        var_name = key[1:]
+        cache_key = (key, hashlib.sha1(json.dumps(obj)).digest())
+        run_metrics.count("objects")
+        if not cache_key in parsed_object_cache:
+            capture = LogCapture()
+            logging.getLogger().addHandler(capture)
+            try:
+                d = parse_object_mapping(var_name, obj, cache_key)
+            finally:
+                logging.getLogger().removeHandler(capture)
+            parsed_object_cache[cache_key] = (d, capture.messages)
+        else:
+            run_metrics.count("objects reused")
+            (d, messages) = parsed_object_cache[cache_key]
+            for (level, message) in messages:
+                logging.log(level, message)
 
-    for el in schema:
-        if len(el.keys()) != 1:
-            logging.error("Mapping a key in `objects` should contain a single object only")
+        for r in d.subclasses:
+            if not "$" + r.object_name in completed_objects:
+                logging.error("Incomplete reference %s to $%s " % (r.name, r.object_name))
 
-        for key in el.keys():
-            obj = el[key]
+        request_objects.append(d)
+        completed_objects.add(key)
 
-            if key[0:1] != "$":
-                logging.error("Not an object definition in the format $defName: %s" % key)
-                continue
+def parse_all_objects(schema):
+    completed_objects = set() # object names with the $ prefix
+    request_objects = []
 
-            var_name = key[1:]
-            d = parse_object_mapping(var_name, obj, completed_objects)
-            request_objects.append(d)
-            completed_objects.append(key)
+    for el in schema:
+        parse_object_definition(el, request_objects, completed_objects)
 
     return request_objects
 
 
-def parse_objects_from_list(expanded_objects, list):
-    request_objects = []
-
-    for d in expanded_objects:
-        if d["var_name"] in list:
-            request_objects.append(d)
-
-    return request_objects
+def parse_objects_from_list(symbols, list):
+    wanted = set(list)
+    return [symbols["objects"][name] for name in symbols["names"] if name in wanted]
 
-# Input schema:
+# Input schema, a list of ObjectDef:
 # [
-# {'class_name': u'ChangePasswordRequest', 
-#   'is_cached': False,
-#   'var_name': u'changePasswordRequest',
-#   'subclasses': [], 
-#   'attrs': [(u'new_password', 'NSString', 'NSStringAttributeType', False, False),
-#             (u'old_password', 'NSString', 'NSStringAttributeType', False, False)]
-# },
-# {'class_name': u'SignupRequest', 
-#    'is_cached': False,
-#    'var_name': u'signupRequest',
-#   ... 
-# }
+# ObjectDef(var_name=u'changePasswordRequest', class_name=u'ChangePasswordRequest', is_cached=False,
+#           attrs=(Attribute(name=u'new_password', ns_type='NSString', cd_type='NSStringAttributeType', is_primary=False, is_optional=False),
+#                  Attribute(name=u'old_password', ns_type='NSString', cd_type='NSStringAttributeType', is_primary=False, is_optional=False)),
+#           subclasses=()),
+# ObjectDef(var_name=u'signupRequest', class_name=u'SignupRequest', is_cached=False,
+#   ...
+# )
 # ]
 def print_request_mapping(schema, outfile):
     for d in schema:
-        print_object_request_mapping(outfile, d['var_name'], d['class_name'], d['attrs'], d['subclasses'],d['is_cached'])
+        print_object_request_mapping(outfile, d)
 
 def print_response_mapping(schema, outfile):
     for d in schema:
-        print_object_response_mapping(outfile, d['var_name'], d['class_name'], d['attrs'], d['subclasses'],d['is_cached'])
+        print_object_response_mapping(outfile, d)
 
 
-# HERE IT IS
-        
-def create_object_files_at_project_dir_from_internal_schema(project_dir, schema):
+# previous_objects maps class names to the expanded objects emitted by a previous run in this
+# process (see watch). An object with the same definition_key has an unchanged definition, even
+# when it was loaded again from the schema cache, and its files are not rendered or compared again.
+# Returns the class names mapped to the expanded objects emitted by this run
+def create_object_files_at_project_dir_from_internal_schema(project_dir, schema, previous_objects=None):
     objs_dir = project_dir + "/Objects/"
 
-    if not os.path.exists(objs_dir):
+    if os.path.exists(objs_dir):
+        old_files = os.listdir(objs_dir)
+    elif dry_run:
+        old_files = []
+    else:
         os.makedirs(objs_dir)
-
-    old_files = os.listdir(objs_dir)
+        old_files = []
     current_files = []
 
+    # an object may be both a request and a response, only emit it once
+    objects = []
+    emitted = OrderedDict()
     for d in schema:
-        current_files += create_object_files(objs_dir, d['class_name'], d['attrs'], d['subclasses'], d['is_cached'])
+        if not d.class_name in emitted:
+            emitted[d.class_name] = d
+            previous = previous_objects.get(d.class_name) if previous_objects else None
+            if previous and previous.definition_key == d.definition_key and \
+               os.path.isfile(objs_dir + d.class_name + ".h") and os.path.isfile(objs_dir + d.class_name + ".m"):
+                current_files += [d.class_name + ".h", d.class_name + ".m"]
+                run_metrics.count("files unchanged", 2)
+            else:
+                objects.append(d)
+
+    # load the template and run values up front so the workers only read shared state
+    compile_template(template_dir + template_file)
+    get_template_values()
+
+    if jobs > 1 and len(objects) > 1:
+        pool = ThreadPool(min(jobs, len(objects)))
+        try:
+            results = pool.map(lambda d: create_object_files(objs_dir, d), objects)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [create_object_files(objs_dir, d) for d in objects]
+
+    # results are in schema order regardless of which worker finished first
+    for files in results:
+        for (file_name, status) in files:
+            log_file_status(file_name, status)
+            current_files.append(file_name)
 
-    for file_name in set(old_files).difference(set(current_files)):
-        os.remove(objs_dir + file_name)
+    delete_stale_files(objs_dir, set(old_files).difference(set(current_files)))
+
+    return emitted
+
+# deletes files of parent_dir that are no longer generated, they are only reported in a dry run
+def delete_stale_files(parent_dir, file_names):
+    for file_name in sorted(file_names):
+        if dry_run:
+            log_file_status(file_name, "stale")
+            continue
+        os.remove(parent_dir + file_name)
         logging.info("Deleted: %s" % file_name)
+        run_metrics.count("files deleted")
 
 # def parse_response_objects_from_list(schema, list, outfile):
 #     completed_objects = [] # object names with the $ prefix
@@ -850,17 +1762,22 @@ def get_rk_method(method):
 # Assumptions:
 # Payload:
 #    "$someObject"
-def print_request_url(outfile, url, request, method):
+# Returns:
+#   {'name': u'signupRequest_RequestPost_as', 'var_name': u'signupRequest',
+#    'class_name': u'SignupRequest', 'rk_method': 'RKRequestMethodPOST'}
+def parse_request_descriptor(url, request, method):
     var_name = request[1:]
-    class_name = titlecase(var_name)
     suffix = "_" + make_suffix(url)
 
-    rk_method = get_rk_method(method)
-
-    outfile.write('RKRequestDescriptor* %s_Request%s%s = [RKRequestDescriptor requestDescriptorWithMapping:%sRequestMapping objectClass:[%s class] rootKeyPath:nil method:%s];\n' %
-        (var_name, titlecase(method),suffix, var_name, class_name, rk_method))
+    return { "name" : "%s_Request%s%s" % (var_name, titlecase(method), suffix),
+             "var_name" : var_name,
+             "class_name" : titlecase(var_name),
+             "rk_method" : get_rk_method(method) }
 
-    return (var_name, "%s_Request%s%s" % (var_name, titlecase(method), suffix))
+# name is the unique variable name of the descriptor, see print_url_mappings
+def print_request_descriptor(outfile, descriptor, name):
+    outfile.write('RKRequestDescriptor* %s = [RKRequestDescriptor requestDescriptorWithMapping:%sRequestMapping objectClass:[%s class] rootKeyPath:nil method:%s];\n' %
+        (name, descriptor["var_name"], descriptor["class_name"], descriptor["rk_method"]))
 
 
 # Assumptions:
@@ -875,23 +1792,20 @@ def print_request_url(outfile, url, request, method):
 #    { "200+" : "$someObject",
 #      "keyPath" : "objects" }
 # Returns:
-#   name of the response descriptor
-def print_response_url(outfile, url, response, method):
+#   {'name': u'user_ResponseGet_uu', 'var_name': u'user', 'rk_method': 'RKRequestMethodGET',
+#    'path_pattern': '@"users/:username/"', 'key_path': '@"objects"', 'codes': 'successCodes'}
+# The payload itself is left untouched.
+def parse_response_descriptor(url, response, method):
     codes = "successCodes"
     keyPath = "nil"
     var_name = None
     var_name_suffix = method
 
-    rk_method = get_rk_method(method)
-
     if isinstance(response, dict):
-        keys = list(response.keys())
-        values = response.values()
+        keys = [key for key in response.keys() if key != "keyPath"]
 
-        if "keyPath" in keys:
+        if "keyPath" in response:
             keyPath = '@"%s"' % response["keyPath"]
-            response.pop("keyPath")
-            keys.remove("keyPath")
 
         if len(keys) != 1:
             logging.warning("Don't understand response for url=%s and keypath=%s" % (url, keyPath))
@@ -913,12 +1827,128 @@ def print_response_url(outfile, url, response, method):
     if url != "nil":
         url = '@"%s"' % url
 
-    outfile.write('RKResponseDescriptor* %s_Response%s%s = [RKResponseDescriptor responseDescriptorWithMapping:%sResponseMapping method:%s pathPattern:%s keyPath:%s statusCodes:%s];\n' %
-                (var_name, var_name_suffix, second_suffix, var_name, rk_method, url, keyPath, codes))
-
-    return (var_name, "%s_Response%s%s" % (var_name, var_name_suffix, second_suffix))
-
-
+    return { "name" : "%s_Response%s%s" % (var_name, var_name_suffix, second_suffix),
+             "var_name" : var_name,
+             "rk_method" : get_rk_method(method),
+             "path_pattern" : url,
+             "key_path" : keyPath,
+             "codes" : codes }
+
+# name is the unique variable name of the descriptor, see print_url_mappings
+def print_response_descriptor(outfile, descriptor, name):
+    outfile.write('RKResponseDescriptor* %s = [RKResponseDescriptor responseDescriptorWithMapping:%sResponseMapping method:%s pathPattern:%s keyPath:%s statusCodes:%s];\n' %
+                (name, descriptor["var_name"], descriptor["rk_method"], descriptor["path_pattern"], descriptor["key_path"], descriptor["codes"]))
+
+# extract the meta tag of a method and convert long form names to short form
+def parse_auth_type(meta):
+    auth_type = meta.split(",")
+
+    if "basicauth" in auth_type:
+        auth_type.append("basic")
+        auth_type.remove("basicauth")
+    elif "tastypieauth" in auth_type:
+        auth_type.append("tastypie")
+        auth_type.remove("tastypieauth")
+
+    return auth_type
+
+# Tags of a get `#meta` asking for page methods, along with an optional "pageSize" : 20.
+# `prefetch` maps the next page as soon as a page is delivered.
+PAGINATION_TAGS = ["paginated", "prefetch"]
+DEFAULT_PAGE_SIZE = 20
+
+# Returns None or {'page_size': 20, 'prefetch': False} for a method definition
+def parse_pagination(method, definition, url):
+    tags = definition["#meta"].split(",") if "#meta" in definition else []
+    if not "paginated" in tags:
+        if "prefetch" in tags or "pageSize" in definition:
+            logging.warning("The %s `%s` sets a page size or prefetch without being `paginated`" % (method, url))
+        return None
+    if method != "get":
+        logging.warning("Only get can be `paginated`, not %s `%s`" % (method, url))
+        return None
+
+    page_size = definition.get("pageSize", DEFAULT_PAGE_SIZE)
+    if not isinstance(page_size, int) or page_size < 1:
+        logging.warning("The pageSize of get `%s` must be a positive integer, using %d" % (url, DEFAULT_PAGE_SIZE))
+        page_size = DEFAULT_PAGE_SIZE
+
+    return { "page_size" : page_size,
+             "prefetch" : "prefetch" in tags }
+
+# a `conditional` get revalidates its last result with If-None-Match and If-Modified-Since
+CONDITIONAL_TAG = "conditional"
+
+# a `coalesced` get shares one request among the identical calls made while it is in flight
+COALESCED_TAG = "coalesced"
+
+# A post, put or patch tagged `bulk` also sends arrays of request objects in a single Tastypie
+# list request, in batches of at most "batchSize" objects when given
+BULK_TAG = "bulk"
+BULK_METHODS = ["post", "put", "patch"]
+
+# Returns None or {'batch_size': None} for a method definition
+def parse_bulk(method, definition, url, tags):
+    if not BULK_TAG in tags:
+        if "batchSize" in definition:
+            logging.warning("The %s `%s` sets a batch size without being `bulk`" % (method, url))
+        return None
+    if not method in BULK_METHODS:
+        logging.warning("Only %s can be `bulk`, not %s `%s`" % (", ".join(BULK_METHODS), method, url))
+        return None
+    if not is_list_url(url):
+        logging.warning("The bulk %s `%s` must use a list url, not one ending with a primary key" % (method, url))
+        return None
+
+    batch_size = definition.get("batchSize")
+    if batch_size is not None and (not isinstance(batch_size, int) or batch_size < 1):
+        logging.warning("The batchSize of %s `%s` must be a positive integer, objects are sent in a single request" % (method, url))
+        batch_size = None
+    elif batch_size is not None and method == "put":
+        # every request of a put list replaces the whole collection
+        logging.warning("The bulk put `%s` cannot be sent in batches, objects are sent in a single request" % url)
+        batch_size = None
+
+    return { "batch_size" : batch_size }
+
+# a list url doesn't end with a `:primary_key`, e.g. posts/ or posts/:id/comments/
+def is_list_url(url):
+    return not url.rstrip("/").split("/")[-1].startswith(":")
+
+# A get whose API selects fields or expands relationships names the query parameters doing so:
+#   "get" : {"response" : ..., "fieldsParameter" : "fields", "expandParameter" : "expand"}
+SPARSE_KEYS = ["fieldsParameter", "expandParameter"]
+
+# Returns None or {'fields': 'fields', 'expand': None} for a method definition
+def parse_sparse(method, definition, url):
+    names = [definition.get(key) for key in SPARSE_KEYS]
+    if names == [None, None]:
+        return None
+    if method != "get":
+        logging.warning("Only get can select fields, not %s `%s`" % (method, url))
+        return None
+    if names[0] is None:
+        logging.warning("The get `%s` sets an expandParameter without a fieldsParameter" % url)
+        return None
+
+    for (key, name) in zip(SPARSE_KEYS, names):
+        if name is not None and not isinstance(name, basestring):
+            logging.warning("The %s of get `%s` must be the name of a query parameter" % (key, url))
+            return None
+
+    return { "fields" : names[0],
+             "expand" : names[1] }
+
+# tags of a method `#meta` that are not an auth type
+OPERATION_TAGS = frozenset(PAGINATION_TAGS + [CONDITIONAL_TAG, COALESCED_TAG, BULK_TAG])
+
+# methods in the order their descriptors are mapped, and in the order their operations are printed
+MAPPING_METHODS = ["get", "post", "put", "patch", "delete"]
+OPERATION_METHODS = ["post", "put", "patch", "delete", "get"]
+
+# Parses the url definitions into the endpoint IR in a single walk. Every emitter renders from
+# this IR, so no url definition is parsed more than once per run.
+#
 # Payload:
 #   {"url" : "some_url/",
 #    "get" : { <response> },
@@ -927,57 +1957,260 @@ def print_response_url(outfile, url, response, method):
 #     ...}
 # or
 #   {<response>}
-def parse_urls(schema, outfile):
-    requests = []
-    responses = []
-    root_objects = []
-
-    request_mappings = []
-    response_mappings = []
-
-    # write out responses associated to an url
+#
+# Output:
+# {'endpoints': [{'url': 'users/:username/',
+#                 'doc': 'User resource',
+#                 'operations': {'get': <operation>, 'patch': <operation>, ...}}],
+#  'root_responses': [<response descriptor>, ...]}
+#
+# <operation>:
+# {'method': 'get', 'doc': 'Fetch a user', 'auth_type': ['tastypie', 'optional'],
+#  'request': None, 'response': u'user', 'prototype': u'user', 'parameters': None,
+#  'request_descriptor': None, 'response_descriptor': <response descriptor>,
+#  'paginated': None, 'conditional': False, 'coalesced': False, 'bulk': None, 'sparse': None,
+#  'printable': True}
+#
+# 'paginated' is {'page_size': 20, 'prefetch': False} for a get tagged `paginated`, see parse_pagination
+# 'conditional' is set for a get tagged `conditional`, see print_conditional_get
+# 'coalesced' is set for a get tagged `coalesced`, see print_coalesced_callbacks
+# 'bulk' is {'batch_size': None} for a post, put or patch tagged `bulk`, see parse_bulk
+# 'sparse' is {'fields': 'fields', 'expand': None} for a get selecting fields, see parse_sparse
+#
+# resolve_endpoints later adds the referenced objects to every operation.
+def parse_urls(schema):
+    endpoint_ir = { "endpoints" : [],
+                    "root_responses" : [] }
 
     for obj in schema:
-        url = "nil"
-        if "url" in obj:
-            original_url = fix_url_path(obj["url"])
+        parse_url_definition(obj, endpoint_ir)
 
-            first_time = True
+    return endpoint_ir
 
-            for method in ["get", "post", "put", "patch", "delete"]:
-                if method in obj:
-                    if "response" in obj[method]:
-                        if first_time:
-                            outfile.write("\n// Mapping for %s\n\n" % original_url)
-                            first_time = False
+# Parsed url definitions are cached by content until a watch run stops using them, so a schema
+# regenerated in watch mode only parses the entries that were modified.
+parsed_url_cache = RunCache()
 
-                        (var_name, response_name) = print_response_url(outfile, original_url, obj[method]["response"], titlecase(method))
-                        responses.append(response_name)
-                        response_mappings.append(var_name)
+# parses a single entry of `urls` into endpoint_ir
+def parse_url_definition(obj, endpoint_ir):
+    cache_key = hashlib.sha1(json.dumps(obj)).digest()
+    run_metrics.count("urls")
+    if not cache_key in parsed_url_cache:
+        parsed_url_cache[cache_key] = parse_url_entry(obj)
+    else:
+        run_metrics.count("urls reused")
 
-                    if "request" in obj[method]:
-                        if first_time:
-                            outfile.write("\n// Mapping for %s\n\n" % original_url)
-                            first_time = False
+    (kind, parsed) = parsed_url_cache[cache_key]
+    if kind == "root":
+        endpoint_ir["root_responses"].append(parsed)
+    else:
+        # resolve_endpoints sets per occurrence keys, such as the url name, on the operations
+        # of an endpoint, so identical entries don't share them with each other or the cache
+        operations = dict([(method, dict(op)) for (method, op) in parsed["operations"].items()])
+        endpoint_ir["endpoints"].append(dict(parsed, operations=operations))
+
+# Returns ("root", <response descriptor>) or ("endpoint", <endpoint>)
+def parse_url_entry(obj):
+    if not "url" in obj:
+        return ("root", parse_response_descriptor("nil", obj, ""))
+
+    url = fix_url_path(obj["url"])
+    operations = {}
+
+    for method in MAPPING_METHODS:
+        if not method in obj:
+            continue
+
+        definition = obj[method]
+        op_tags = definition["#meta"].split(",") if "#meta" in definition else []
+        op = { "method" : method,
+               "doc" : definition.get("doc", ""),
+               "auth_type" : parse_auth_type(definition["#meta"]) if "#meta" in definition else [],
+               "request" : None,
+               "response" : None,
+               "prototype" : None,
+               "parameters" : None,
+               "request_descriptor" : None,
+               "response_descriptor" : None,
+               "paginated" : parse_pagination(method, definition, url),
+               "conditional" : CONDITIONAL_TAG in op_tags,
+               "coalesced" : COALESCED_TAG in op_tags,
+               "bulk" : parse_bulk(method, definition, url, op_tags),
+               "sparse" : parse_sparse(method, definition, url),
+               "printable" : True }
+        op["auth_type"] = [tag for tag in op["auth_type"] if not tag in OPERATION_TAGS]
+
+        for tag in [CONDITIONAL_TAG, COALESCED_TAG]:
+            if op[tag] and method != "get":
+                logging.warning("Only get can be `%s`, not %s `%s`" % (tag, method, url))
+                op[tag] = False
+
+        if "response" in definition:
+            op["response_descriptor"] = parse_response_descriptor(url, definition["response"], titlecase(method))
+            op["response"] = op["response_descriptor"]["var_name"]
+
+        if "request" in definition:
+            op["request_descriptor"] = parse_request_descriptor(url, definition["request"], titlecase(method))
+            op["request"] = op["request_descriptor"]["var_name"]
+
+        if "prototype" in definition:
+            op["prototype"] = get_object_name_from_reference(definition["prototype"])
+
+        if "parameters" in definition:
+            op["parameters"] = get_object_name_from_reference(definition["parameters"])
+
+        if method == "get":
+            if op["response"]:
+                if op["request"]:
+                    logging.error("Cannot make a %s `%s` request for the url `%s`" % (method, titlecase(op["response"]), url))
+            else:
+                logging.error("Cannot map a %s `%s` request without a response definition" % (method,url))
+                op["printable"] = False
+        elif method == "delete":
+            # use the prototype object to sniff out the primary key
+            if not op["prototype"]:
+                logging.error("Canno map %s `%s` without a prototype " % (method,url))
+                op["printable"] = False
+        elif not op["request"]:
+            logging.error("Cannot make a %s `%s` without a request definition" % (method, url))
+            op["printable"] = False
+
+        operations[method] = op
+
+    return ("endpoint", { "url" : url,
+                          "doc" : obj.get("doc", ""),
+                          "operations" : operations })
+
+# Attaches the objects referenced by each operation, looked up once in the symbol table:
+#   'request_object', 'prototype_object' (None without a prototype) and 'param', a tuple of Attribute
+# sets 'emit' when the operation is printable and its objects are defined, and 'url_name', the
+# url in the selector of the operation, unique among the operations of the same method.
+# 'pagination' is None or {'page_size', 'prefetch', 'meta_key_path'}, see find_page_meta
+# Parsed operations are cached between runs, so only these keys may be modified here.
+def resolve_endpoints(endpoint_ir, symbols):
+    selectors = dict([(method, SymbolRegistry("Selector")) for method in OPERATION_METHODS])
+    meta_key_path = find_page_meta(endpoint_ir, symbols)
+
+    def resolve(name, kind, method, url):
+        d = find_object(symbols, name)
+        if not d:
+            logging.error("The %s `%s` of %s `%s` is not defined" % (kind, name, method, url))
+        return d
+
+    for endpoint in endpoint_ir["endpoints"]:
+        url = endpoint["url"]
+        for (method, op) in endpoint["operations"].items():
+            op["emit"] = op["printable"]
+            op["param"] = ()
+            if op["parameters"]:
+                d = resolve(op["parameters"], "parameters", method, url)
+                if d:
+                    op["param"] = d.attrs
+                    # only use primitive parameters for now, we don't waste time with nested object parameters
+                    if d.has_relationships:
+                        logging.error("Non-primitive parameters are presently disallowed for %s `%s`" % (method, url))
+
+            op["prototype_object"] = None
+            if op["prototype"]:
+                d = resolve(op["prototype"], "prototype", method, url)
+                if d:
+                    op["prototype_object"] = d
+                elif method == "delete":
+                    op["emit"] = False
+
+            op["request_object"] = None
+            if op["request"]:
+                op["request_object"] = resolve(op["request"], "request", method, url)
+                if not op["request_object"] and method != "get":
+                    op["emit"] = False
+
+            op["pagination"] = None
+            if op["paginated"]:
+                if not meta_key_path:
+                    logging.warning("No root response has the `limit`, `offset` and `next` of a page, the next page of %s `%s` is looked up under `meta`" % (method, url))
+                op["pagination"] = dict(op["paginated"], meta_key_path=meta_key_path or '@"meta"')
+            elif method == "get" and op["emit"] and meta_key_path and is_list_url(url) and op["response_descriptor"]["key_path"] == '@"objects"':
+                op["pagination"] = { "page_size" : DEFAULT_PAGE_SIZE,
+                                     "prefetch" : False,
+                                     "meta_key_path" : meta_key_path }
+
+        for method in OPERATION_METHODS:
+            if method in endpoint["operations"]:
+                op = endpoint["operations"][method]
+                op["url_name"] = selectors[method].claim(underscore_to_camel(url), "%s `%s`" % (method, url))
+
+# Returns the key path of the root response describing a page, like the MCMeta of Tastypie
+#   {"keyPath" : "meta", "200+" : "$MCMeta"}
+# with the `limit`, `offset` and `next` attributes, or None. The collections of list urls are
+# then paginated when their response is under the `objects` key path.
+def find_page_meta(endpoint_ir, symbols):
+    for descriptor in endpoint_ir["root_responses"]:
+        d = find_object(symbols, descriptor["var_name"])
+        if d and set(["limit", "offset", "next"]).issubset([a.name for a in d.attrs]):
+            return descriptor["key_path"]
+    return None
 
-                        (var_name, request_name) = print_request_url(outfile, original_url, obj[method]["request"], titlecase(method))
-                        requests.append(request_name)
-                        request_mappings.append(var_name)
+# Writes the request and response descriptors of endpoints, then those of root_responses
+# Returns:
+#   (requests, responses, request_mappings, response_mappings), the descriptor variable names
+#   and the names of the objects used by the descriptors
+# Descriptor variable names are claimed in descriptor_names, see SymbolRegistry
+def print_descriptors(endpoints, root_responses, descriptor_names, outfile):
+    requests = []
+    responses = []
 
+    request_mappings = []
+    response_mappings = []
 
+    # write out responses associated to an url
 
-        else:
-            root_objects.append(obj)
+    for endpoint in endpoints:
+        first_time = True
+
+        for method in MAPPING_METHODS:
+            if method in endpoint["operations"]:
+                op = endpoint["operations"][method]
+                for descriptor in [op["response_descriptor"], op["request_descriptor"]]:
+                    if not descriptor:
+                        continue
+
+                    if first_time:
+                        outfile.write("\n// Mapping for %s\n\n" % endpoint["url"])
+                        first_time = False
+
+                    name = descriptor_names.claim(descriptor["name"], "%s `%s`" % (method, endpoint["url"]))
+                    if descriptor is op["response_descriptor"]:
+                        print_response_descriptor(outfile, descriptor, name)
+                        responses.append(name)
+                        response_mappings.append(descriptor["var_name"])
+                    else:
+                        print_request_descriptor(outfile, descriptor, name)
+                        requests.append(name)
+                        request_mappings.append(descriptor["var_name"])
 
     # write out root responses thereafter
 
-    if len(root_objects):
+    if len(root_responses):
         outfile.write("\n// Responses applied to any URL\n\n")
 
-    for obj in root_objects:
-        (var_name, response_name) = print_response_url(outfile, url, obj, "")
-        responses.append(response_name)
-        response_mappings.append(var_name)
+    for descriptor in root_responses:
+        name = descriptor_names.claim(descriptor["name"], "the root response of `$%s`" % descriptor["var_name"])
+        print_response_descriptor(outfile, descriptor, name)
+        responses.append(name)
+        response_mappings.append(descriptor["var_name"])
+
+    run_metrics.count("request descriptors", len(requests))
+    run_metrics.count("response descriptors", len(responses))
+
+    return (requests, responses, request_mappings, response_mappings)
+
+# Writes the request and response descriptors of every url, then configures the object manager
+# Returns:
+#   (request_mappings, response_mappings), the names of the objects used by the descriptors
+# Descriptor variable names are made unique across the file, see SymbolRegistry
+def print_url_mappings(endpoint_ir, outfile):
+    (requests, responses, request_mappings, response_mappings) = print_descriptors(
+        endpoint_ir["endpoints"], endpoint_ir["root_responses"], SymbolRegistry("Descriptor"), outfile)
 
     outfile.write('''
 
@@ -997,175 +2230,533 @@ manager.managedObjectStore = managedObjectStore;
 
     return (request_mappings, response_mappings)
 
+# Groups the endpoints into shards by the first component of their url, e.g. `posts/` and
+# `posts/:id/comments/` both go to the `Posts` shard
+# Returns:
+#   OrderedDict([('Users', [<endpoint>, ...]), ('Posts', [...])]) in the order of the urls
+def shard_endpoints(endpoint_ir):
+    shards = OrderedDict()
+    for endpoint in endpoint_ir["endpoints"]:
+        prefix = endpoint["url"].split("/")[0]
+        name = titlecase(SHARD_NAME_SEPARATORS.sub("", underscore_to_camel(prefix))) or "Root"
+        shards.setdefault(name, []).append(endpoint)
+    return shards
+
+SHARD_NAME_SEPARATORS = re.compile("[^a-zA-Z0-9]")
+
+# the object mappings of a shard setup are looked up in the `mappings` dictionary built by
+# objectMappingsWithStore:
+def lookup_mapping_in_dictionary(mapping_name):
+    return 'mappings[@"%s"]' % mapping_name
+
+# the object mappings of a lazy descriptor registration are built by their accessor
+def lookup_mapping_accessor(mapping_name):
+    return "get%s()" % titlecase(mapping_name)
+
+# Writes the body of a shard setup method: the object mappings used by the shard are looked up
+# with lookup, then the descriptors of the shard are created and added to `manager`
+# Returns:
+#   (request_mappings, response_mappings), the names of the objects used by the descriptors
+def print_shard_setup(endpoints, root_responses, descriptor_names, outfile, lookup=lookup_mapping_in_dictionary):
+    descriptor_buffer = StringIO.StringIO()
+    (requests, responses, request_mappings, response_mappings) = print_descriptors(
+        endpoints, root_responses, descriptor_names, descriptor_buffer)
+
+    outfile.write(STATUS_CODE_SETS)
+    outfile.write("\n")
+    for (names, kind) in [(request_mappings, "Request"), (response_mappings, "Response")]:
+        for var_name in sorted(set(names)):
+            mapping_name = "%s%sMapping" % (var_name, kind)
+            outfile.write('RKMapping* %s = %s;\n' % (mapping_name, lookup(mapping_name)))
+    outfile.write(descriptor_buffer.getvalue())
+    outfile.write("\n")
+    if requests:
+        outfile.write("[manager addRequestDescriptorsFromArray:@[%s]];\n" % ", ".join(requests))
+    if responses:
+        outfile.write("[manager addResponseDescriptorsFromArray:@[%s]];\n" % ", ".join(responses))
 
+    return (request_mappings, response_mappings)
 
-# Input url:
-#   {
-#        "url" : "some_url/",
-#        "get" : { <response> },
-#        "post" : { <response> },
-#        "put" : { <response> },
-#         ...
-#   }
-# or
-#   {
-#        <response>
-#   }
-#
-# Input objects (expanded object schema):
-# [
-# {'class_name': u'ChangePasswordRequest', 
-#   'is_cached': False,
-#   'var_name': u'changePasswordRequest',
-#   'subclasses': [], 
-#   'attrs': [(u'new_password', 'NSString', 'NSStringAttributeType', False, False),
-#             (u'old_password', 'NSString', 'NSStringAttributeType', False, False)]
-# },
-# {'class_name': u'SignupRequest', 
-#    'is_cached': False,
-#    'var_name': u'signupRequest',
-#   ... 
-# }
-# ]
-def print_methods_from_urls(urls, objects, is_header, outfile):
-    # write out responses associated to an url
+# Input endpoint IR (see parse_urls and resolve_endpoints)
+# preludes optionally lists the code run first by the methods of each endpoint, in endpoint order
+def print_methods_from_urls(endpoint_ir, is_header, outfile, preludes=None):
+    for (i, endpoint) in enumerate(endpoint_ir["endpoints"]):
+        url = endpoint["url"]
+        prelude = preludes[i] if preludes else ""
 
-    for obj in urls:
-        if "url" in obj:
-            url = fix_url_path(obj["url"])
-
-            outfile.write("\n// Operations for `%s`\n" % url)
-
-            if is_header and "doc" in obj:
-                if len(obj["doc"]) > 0:
-                    outfile.write("// %s\n" % obj["doc"])
-            outfile.write("\n")
-
-            for method in ["post", "put", "patch", "delete", "get"]:
-                if method in obj:
-                    if is_header and "doc" in obj[method]:
-                        if len(obj[method]["doc"]) > 0:
-                            outfile.write("// %s\n" % obj[method]["doc"])
-
-                    # extract the meta tag and handle the instruction
-                    auth_type = ""
-                    if "#meta" in obj[method]:
-                        auth_type = obj[method]["#meta"].split(",")
-
-                        # convert long form names to short form
-                        if "basicauth" in auth_type:
-                            auth_type.append("basic")
-                            auth_type.remove("basicauth")
-                        elif "tastypieauth" in auth_type:
-                            auth_type.append("tastypie")
-                            auth_type.remove("tastypieauth")
-
-                    param = []
-                    if "parameters" in obj[method]:
-                        d = find_key_in_array_of_dict("var_name", obj[method]["parameters"][1:], objects)
-                        param = d['attrs']
-                        # only use primitive parameters for now, we don't waste time with nested object parameters
-                        if len(d['subclasses']) > 0:
-                            logging.error("Non-primitive parameters are presently disallowed for %s `%s`" % (method, url))
-
-                    prototype_attrs = None
-                    if "prototype" in obj[method]:
-                        (v2, r2) = print_response_url(StringIO.StringIO(), url, obj[method]["prototype"], titlecase(method))
-                        class_name = titlecase(v2)
-                        d = find_key_in_array_of_dict("var_name", v2, objects)
-                        prototype_attrs = d["attrs"]
-
-                    if method == "get":
-                        if "response" in obj[method]:
-                            (var_name, response_name) = print_response_url(StringIO.StringIO(), url, obj[method]["response"], titlecase(method))
-                            class_name = titlecase(var_name)
-
-                            if "request" in obj[method]:
-                                logging.error("Cannot make a %s `%s` request for the url `%s`" % (method, class_name, url))
-
-                            print_get_method(url, outfile, var_name, class_name, prototype_attrs, param, is_header, auth_type)
-                        else:
-                            logging.error("Cannot map a %s `%s` request without a response definition" % (method,url))
-
-                    elif method == "delete":
-                        # use either the request or response object to sniff out the primary key
-                        if prototype_attrs:
-                            print_delete_method(url, outfile, prototype_attrs, param, is_header, auth_type)
-                        else:
-                            logging.error("Canno map %s `%s` without a prototype " % (method,url))                        
-                    else:
+        outfile.write("\n// Operations for `%s`\n" % url)
 
-                        if "request" in obj[method]:
-                            (var_name, request_name) = print_request_url(StringIO.StringIO(), url, obj[method]["request"], titlecase(method))
-                            class_name = titlecase(var_name)
-                            d = find_key_in_array_of_dict("var_name", var_name, objects)
-                            print_access_method(method, url, var_name, class_name, d['attrs'], prototype_attrs, d['subclasses'], param, is_header, outfile, auth_type)
-                        else:
-                            logging.error("Cannot make a %s `%s` without a request definition" % (method, url))
+        if is_header and len(endpoint["doc"]) > 0:
+            outfile.write("// %s\n" % endpoint["doc"])
+        outfile.write("\n")
 
+        for method in OPERATION_METHODS:
+            if not method in endpoint["operations"]:
+                continue
 
-def print_imports(list, outfile):
-    for v in list:
-        outfile.write('#import "%s.h"\n' % titlecase(v))
+            op = endpoint["operations"][method]
+            if is_header and len(op["doc"]) > 0:
+                outfile.write("// %s\n" % op["doc"])
 
+            if not op["emit"]:
+                continue
+
+            if method == "get":
+                var_name = op["response"]
+                print_get_method(url, op["url_name"], outfile, var_name, titlecase(var_name), op["prototype_object"], op["param"], is_header, op["auth_type"], prelude, op["conditional"], op["coalesced"])
+                if op["sparse"]:
+                    print_sparse_get_method(url, op["url_name"], outfile, titlecase(var_name), op["prototype_object"], op["param"], is_header, op["auth_type"], op["sparse"], prelude)
+                if op["pagination"]:
+                    print_page_methods(url, op["url_name"], outfile, op["prototype_object"], op["param"], is_header, op["auth_type"], op["pagination"], prelude)
+            elif method == "delete":
+                print_delete_method(url, op["url_name"], outfile, op["prototype_object"], op["param"], is_header, op["auth_type"], prelude)
+            else:
+                print_access_method(method, url, op["url_name"], op["request_object"], op["prototype_object"], op["param"], is_header, outfile, op["auth_type"], prelude)
+                if op["bulk"]:
+                    print_bulk_method(method, url, op["url_name"], op["request_object"], op["prototype_object"], op["param"], is_header, outfile, op["auth_type"], op["bulk"], prelude)
 
-# builds an object list that searches for other referenced objects
-def build_object_list(mapping_names, expanded_object_schema):
-    new_list = []
-    referenced_names = []
 
-    # print "Build object list %s" % pformat(mapping_names)
+def print_imports(list, outfile):
+    for v in list:
+        outfile.write('#import "%s.h"\n' % titlecase(v))
 
-    for d in expanded_object_schema:
-        if d["var_name"] in mapping_names:
-            submapping = [obj_name for (var_name, obj_name, is_array) in d["subclasses"]]
-            if len(submapping):
-                new_list.extend(build_object_list(submapping, expanded_object_schema))
-            new_list.append(d["var_name"])
-            referenced_names.append(d["var_name"])
 
-    dif_set = set(mapping_names).difference(referenced_names)
+# Builds the object dependency graph once per run from the symbol table. Edges point from an
+# object to the objects it references through its subclasses. Each object's reachable set is
+# computed exactly once, strongly connected component by component (Tarjan), so the closure is
+# linear in the size of the graph and cannot recurse forever on self-referential objects.
+#
+# Output:
+# {'edges': {u'post': [u'user', u'tag'], u'user': [], u'tag': []},
+#  'dependents': {u'user': [u'post'], u'tag': [u'post'], u'post': []},
+#  'closure': {u'post': frozenset([u'post', u'user', u'tag']), ...},
+#  'cycles': [[u'comment']]}
+def build_dependency_graph(symbols):
+    edges = {}
+    dependents = {}
+    for name in symbols["names"]:
+        edges[name] = []
+        dependents[name] = []
+
+    for name in symbols["names"]:
+        for r in symbols["objects"][name].subclasses:
+            obj_name = r.object_name
+            if obj_name in edges:
+                if not obj_name in edges[name]:
+                    edges[name].append(obj_name)
+                    dependents[obj_name].append(name)
+            else:
+                logging.error("Object `%s` references `%s` which is not defined" % (name, obj_name))
+
+    # iterative Tarjan, components are emitted dependencies first
+    index = {}
+    lowlink = {}
+    on_stack = set()
+    stack = []
+    components = []
+    counter = 0
+
+    for root in symbols["names"]:
+        if root in index:
+            continue
+        work = [(root, 0)]
+        while work:
+            (node, i) = work.pop()
+            if i == 0:
+                index[node] = counter
+                lowlink[node] = counter
+                counter += 1
+                stack.append(node)
+                on_stack.add(node)
+            recurse = False
+            for j in range(i, len(edges[node])):
+                succ = edges[node][j]
+                if not succ in index:
+                    work.append((node, j + 1))
+                    work.append((succ, 0))
+                    recurse = True
+                    break
+                elif succ in on_stack:
+                    lowlink[node] = min(lowlink[node], index[succ])
+            if recurse:
+                continue
+            if lowlink[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+    closure = {}
+    cycles = []
+    for component in components:
+        reachable = set(component)
+        for member in component:
+            for succ in edges[member]:
+                if not succ in reachable:
+                    reachable.update(closure[succ])
+        reachable = frozenset(reachable)
+        for member in component:
+            closure[member] = reachable
+
+        if len(component) > 1 or component[0] in edges[component[0]]:
+            ordered = [name for name in symbols["names"] if name in component]
+            cycles.append(ordered)
+            logging.error("Objects reference each other in a cycle: %s" % " -> ".join(ordered + ordered[0:1]))
+
+    return { "edges" : edges,
+             "dependents" : dependents,
+             "closure" : closure,
+             "cycles" : cycles }
+
+# builds an object list that contains the named objects and every object they reference,
+# in definition order
+def build_object_list(mapping_names, symbols, graph):
+    referenced = set()
+    for name in set(mapping_names):
+        if name in graph["closure"]:
+            referenced.update(graph["closure"][name])
+
+    dif_set = set(mapping_names).difference(graph["closure"].keys())
 
     if len(dif_set) > 0:
         logging.error("Objects were referenced but not defined: %s" % pformat(dif_set))
 
-    return list(set(new_list))
+    return [name for name in symbols["names"] if name in referenced]
 #
 # main method ==================================================================================================================================
 #
 
-def main_script(filename):
-    global field
-    field = raw_input('Please enter field for username: ')
-    print(field)
+def load_schema(filename):
     f = open(filename, "r")
-    schema = json.loads(f.read())
+    schema = json.loads(f.read(), object_pairs_hook=OrderedDict)
     f.close()
+    return schema
 
-    check_schema(schema)
-    #parse_objects_as_responses(schema["objects"], sys.stdout)
+class JSONStreamReader(object):
+    """
+    Reads a JSON document from a file a chunk at a time. Values are decoded one at a time and
+    the text already consumed is dropped, so only the value being decoded is held in memory.
+    """
 
-    mapping_buffer = StringIO.StringIO()
+    def __init__(self, f, chunk_size=65536):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder(object_pairs_hook=OrderedDict)
+
+    def read_more(self, size):
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        chunk = self.f.read(size)
+        if not chunk:
+            self.eof = True
+        self.buf += chunk
+
+    def peek(self):
+        """
+        Skips whitespace and returns the next character, or an empty string at the end of the file
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                return ""
+            self.read_more(self.chunk_size)
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError("Expected `%s` but found `%s`" % (char, self.peek()))
+        self.pos += 1
+
+    # characters that can continue a number, e.g. `2` of `2.5` or `1` of `1e10`
+    NUMBER_CHARS = frozenset("0123456789.eE+-")
+
+    def decode(self):
+        """
+        Decodes the next value. A value followed by the end of the buffer or by a character
+        continuing a number may continue in the next chunk, so it is only accepted once the
+        following character is known or at the end of the file.
+        """
+        self.peek()
+        while True:
+            try:
+                (value, end) = self.decoder.raw_decode(self.buf, self.pos)
+                if (end < len(self.buf) and not self.buf[end] in self.NUMBER_CHARS) or self.eof:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            # grow geometrically so a large value is not re-decoded once per chunk
+            self.read_more(max(self.chunk_size, len(self.buf) - self.pos))
+
+# cache looking up existing managed objects by their identificationAttributes while mapping
+MANAGED_OBJECT_CACHES = OrderedDict([("inmemorycache", "inmemory"),
+                                     ("fetchrequestcache", "fetchrequest")])
+
+# Parses the `#meta` of the schema root, e.g. {"#meta" : "fetchrequestcache", "urls" : ...}
+# Returns the managed object cache, in memory unless fetchrequestcache is given
+def parse_schema_meta(meta):
+    tags = meta.split(",") if meta else []
+    caches = [MANAGED_OBJECT_CACHES[tag] for tag in tags if tag in MANAGED_OBJECT_CACHES]
+    tags = [tag for tag in tags if not tag in MANAGED_OBJECT_CACHES]
+
+    if len(caches) > 1:
+        logging.warning("Only one managed object cache can be used, found %s" % ", ".join(caches))
+    if len(tags) > 0:
+        logging.warning("Don't understand the meta tag %s of the schema" % pformat(tags))
+
+    return caches[0] if caches else "inmemory"
+
+# parses a schema dictionary into (endpoint_ir, expanded_objects)
+def parse_schema(schema):
+    with run_metrics.phase("check schema"):
+        if not check_schema(schema):
+            logging.warning("The schema has errors, the generated files may be incomplete")
+
+    urls = schema.get("urls") if isinstance(schema.get("urls"), list) else []
+    objects = schema.get("objects") if isinstance(schema.get("objects"), list) else []
+    with run_metrics.phase("parse urls"):
+        endpoint_ir = parse_urls(urls)
+        endpoint_ir["managed_object_cache"] = parse_schema_meta(schema.get("#meta"))
+    with run_metrics.phase("parse all objects"):
+        expanded_objects = parse_all_objects(objects)
+    return (endpoint_ir, expanded_objects)
+
+# Streams a schema file into (endpoint_ir, expanded_objects). Each entry of `urls` and `objects`
+# is decoded, validated and parsed one at a time and then dropped, so peak memory does not grow
+# with the size of the raw schema. Same checks as check_schema.
+def load_schema_ir(filename):
+    endpoint_ir = { "endpoints" : [],
+                    "root_responses" : [],
+                    "managed_object_cache" : parse_schema_meta(None) }
+    request_objects = []
+    completed_objects = set()
+    root_keys = set()
+    status = True
 
-    #Testing
-    project_dir = raw_input("Please enter your project directory\n: ")
-    
-    models_dir = project_dir + "/Machine/"
+    f = open(filename, "r")
+    try:
+        reader = JSONStreamReader(f)
+        reader.expect("{")
+        while reader.peek() != "}":
+            if root_keys:
+                reader.expect(",")
+            key = reader.decode()
+            reader.expect(":")
+            root_keys.add(key)
+
+            if key in ["urls", "objects"] and reader.peek() != "[":
+                logging.error("Schema requires `%s` as a list" % key)
+                reader.decode()
+                status = False
+            elif key in ["urls", "objects"]:
+                reader.expect("[")
+                first_entry = True
+                while reader.peek() != "]":
+                    if not first_entry:
+                        reader.expect(",")
+                    first_entry = False
+
+                    with run_metrics.phase("read schema"):
+                        entry = reader.decode()
+                    if key == "urls":
+                        with run_metrics.phase("check schema"):
+                            status = check_url_definition(entry) and status
+                        with run_metrics.phase("parse urls"):
+                            parse_url_definition(entry, endpoint_ir)
+                    else:
+                        with run_metrics.phase("check schema"):
+                            status = check_object_definition(entry) and status
+                        with run_metrics.phase("parse all objects"):
+                            parse_object_definition(entry, request_objects, completed_objects)
+                reader.expect("]")
+            elif key == "#meta":
+                endpoint_ir["managed_object_cache"] = parse_schema_meta(reader.decode())
+            else:
+                reader.decode()
+        reader.expect("}")
+    finally:
+        f.close()
 
-    if not os.path.exists(models_dir):
-        os.makedirs(models_dir)
+    if not ("urls" in root_keys and "objects" in root_keys):
+        logging.error("Schema requires two root nodes `urls` and `objects`")
+        status = False
 
-    print(models_dir)
-    m_buffer = open(models_dir + "MachineDataModel.m", "w")
-    h_buffer = open(models_dir + "MachineDataModel.h", "w")
+    if not status:
+        logging.warning("The schema has errors, the generated files may be incomplete")
 
-    h_buffer.write('''
+    return (endpoint_ir, request_objects)
+
+# Collects the warnings and errors logged while a schema or an object definition is parsed, so
+# that a cached schema or object reports the same problems as a parsed one
+class LogCapture(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append((record.levelno, record.getMessage()))
+
+# Parses a schema file or dictionary and indexes it, this is the work saved by the schema cache
+# Returns:
+#   {'endpoint_ir': ..., 'objects': [<ObjectDef>, ...], 'symbols': ..., 'graph': ...,
+#    'messages': [(logging.WARNING, u'...'), ...]}
+def build_schema_model(schema):
+    capture = LogCapture()
+    logging.getLogger().addHandler(capture)
+    try:
+        if isinstance(schema, basestring):
+            (endpoint_ir, expanded_objects) = load_schema_ir(schema)
+        else:
+            (endpoint_ir, expanded_objects) = parse_schema(schema)
+        with run_metrics.phase("build symbol table"):
+            symbols = build_symbol_table(expanded_objects, endpoint_ir)
+        with run_metrics.phase("build dependency graph"):
+            graph = build_dependency_graph(symbols)
+    finally:
+        logging.getLogger().removeHandler(capture)
+
+    return { "endpoint_ir" : endpoint_ir,
+             "objects" : expanded_objects,
+             "symbols" : symbols,
+             "graph" : graph,
+             "messages" : capture.messages }
+
+# digest of the generator source, cached schemas are invalidated by any change to the generator
+generator_version = None
+
+def get_generator_version():
+    global generator_version
+    if generator_version is None:
+        digest = hashlib.sha1("%d.%d" % sys.version_info[0:2])
+        f = open(os.path.splitext(os.path.realpath(__file__))[0] + ".py", "rb")
+        digest.update(f.read())
+        f.close()
+        generator_version = digest.hexdigest()
+    return generator_version
+
+# the schema cache key is a digest of the schema bytes and of the generator version
+def get_schema_digest(schema):
+    digest = hashlib.sha1(get_generator_version())
+    if isinstance(schema, basestring):
+        f = open(schema, "rb")
+        try:
+            for chunk in iter(lambda: f.read(65536), ""):
+                digest.update(chunk)
+        finally:
+            f.close()
+    else:
+        digest.update(json.dumps(schema))
+    return digest.hexdigest()
+
+# Returns the schema model (see build_schema_model), loaded from cache_dir when the same schema
+# was already parsed by the same generator, and stores it there otherwise. A missing or
+# unreadable cache entry is rebuilt. Nothing is stored in check mode (see dry_run).
+def load_schema_model(schema, cache_dir):
+    path = os.path.join(cache_dir, get_schema_digest(schema) + ".pickle")
+
+    if os.path.isfile(path):
+        try:
+            with run_metrics.phase("load schema cache"):
+                f = open(path, "rb")
+                try:
+                    model = cPickle.load(f)
+                finally:
+                    f.close()
+            run_metrics.count("schema cache hits")
+            run_metrics.count("objects", len(model["objects"]))
+            run_metrics.count("urls", len(model["endpoint_ir"]["endpoints"]) + len(model["endpoint_ir"]["root_responses"]))
+            for (level, message) in model["messages"]:
+                logging.log(level, message)
+            return model
+        except Exception:
+            logging.warning("Ignoring the unreadable schema cache %s" % path)
+
+    model = build_schema_model(schema)
+    if dry_run:
+        return model
+
+    # written to a temporary file first, so that concurrent runs never read a partial entry
+    with run_metrics.phase("store schema cache"):
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        (fd, temp_path) = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        f = os.fdopen(fd, "wb")
+        try:
+            cPickle.dump(model, f, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.rename(temp_path, path)
+
+    return model
+
+STATUS_CODE_SETS = '''NSIndexSet *successCodes = RKStatusCodeIndexSetForClass(RKStatusCodeClassSuccessful);
+NSIndexSet *failCodes = RKStatusCodeIndexSetForClass(RKStatusCodeClassClientError);
+NSIndexSet *serverFailCodes = RKStatusCodeIndexSetForClass(RKStatusCodeClassServerError);
+NSIndexSet *redirectCodes = RKStatusCodeIndexSetForClass(RKStatusCodeClassRedirection);
+'''
+
+MANAGED_OBJECT_STORE_SETUP = '''// managed object manager
+NSError* error = nil;
+NSManagedObjectModel *managedObjectModel = [NSManagedObjectModel mergedModelFromBundles:nil];
+RKManagedObjectStore *managedObjectStore = [[RKManagedObjectStore alloc] initWithManagedObjectModel:managedObjectModel];
+BOOL success = RKEnsureDirectoryExistsAtPath(RKApplicationDataDirectory(), &error);
+if (! success) {
+    RKLogError(@"Failed to create Application Data Directory at path '%@': %@", RKApplicationDataDirectory(), error);
+}
+NSString *path = [RKApplicationDataDirectory() stringByAppendingPathComponent:DATABASE_FILE];
+NSPersistentStore *persistentStore = [managedObjectStore addSQLitePersistentStoreAtPath:path fromSeedDatabaseAtPath:nil withConfiguration:nil options:nil error:&error];
+if (! persistentStore) {
+    RKLogError(@"Failed adding persistent store at path '%@': %@", path, error);
+}
+[managedObjectStore createManagedObjectContexts];
+'''
+
+# Returns the setup of the managed object store. When objects are cached, a managed object cache
+# finds the existing objects of a response without a fetch request per mapped object.
+def print_managed_object_store_setup(managed_object_cache, objects):
+    setup = MANAGED_OBJECT_STORE_SETUP
+    if not any([d.is_cached for d in objects]):
+        return setup
+
+    if managed_object_cache == "fetchrequest":
+        setup += '''managedObjectStore.managedObjectCache = [[RKFetchRequestManagedObjectCache alloc] init];
+'''
+    else:
+        setup += '''managedObjectStore.managedObjectCache = [[RKInMemoryManagedObjectCache alloc] initWithManagedObjectContext:managedObjectStore.persistentStoreManagedObjectContext];
+'''
+    return setup
+
+def print_file_banner(filename, outfile):
+    outfile.write('''
 //
-//  MachineDataModel.h
+//  %s
 //
 //  Copyright (c) 2014 Yeti LLC. All rights reserved.
 //
+''' % filename)
 
+# Writes the single file data model: setupMapping creates every mapping and descriptor, followed
+# by the methods of every url
+# Returns OrderedDict([(filename, contents), ...])
+def print_machine_data_model(endpoint_ir, store_setup, mapping_buffer, mappings, parsed_requests, parsed_responses):
+    m_buffer = StringIO.StringIO()
+    h_buffer = StringIO.StringIO()
+
+    print_file_banner("MachineDataModel.h", h_buffer)
+    h_buffer.write('''
 #import <Foundation/Foundation.h>
 #import <RestKit/RestKit.h>
 
@@ -1174,13 +2765,8 @@ def main_script(filename):
 -(void)setupMapping;
                    ''')
 
+    print_file_banner("MachineDataModel.m", m_buffer)
     m_buffer.write('''
-//
-//  MachineDataModel.m
-//
-//  Copyright (c) 2014 Yeti LLC. All rights reserved.
-//
-
 #import "MachineDataModel.h"
 
 #import <RestKit/RestKit.h>
@@ -1189,54 +2775,481 @@ def main_script(filename):
 #import "AppModel.h"
                    ''')
 
-    # parse and print url mapping buffer
-    (request_mappings, response_mappings) = parse_urls(schema["urls"], mapping_buffer)
+    m_buffer.write("\n")
+    print_imports(mappings, m_buffer)
+    m_buffer.write("\n")
+    m_buffer.write('''
+@implementation MachineDataModel
 
-    # parse object definitions
-    expanded_objects = parse_all_objects(schema["objects"])
+-(void)setupMapping {
+%s
 
-    # build request and response buffer
-    request_mappings = build_object_list(request_mappings, expanded_objects)
-    response_mappings = build_object_list(response_mappings, expanded_objects)
-    mappings = request_mappings[:]
-    mappings.extend(response_mappings)
-    mappings = list(set(mappings)) # remove duplicates
+%s
+// RestKit object mappings
+
+''' % (STATUS_CODE_SETS, store_setup))
+
+    # output mappings for objects that are referenced by requests and responses
+    with run_metrics.phase("print object mappings"):
+        print_request_mapping(parsed_requests, m_buffer)
+        print_response_mapping(parsed_responses, m_buffer)
+
+    m_buffer.write(mapping_buffer.getvalue())
+    m_buffer.write("}\n\n")
+
+    with run_metrics.phase("print methods from urls"):
+        # print headers
+        print_methods_from_urls(endpoint_ir, False, m_buffer)
+        m_buffer.write("\n\n")
+
+        # print body definitions for those headers (DataModel.h)
+        print_methods_from_urls(endpoint_ir, True, h_buffer)
+
+    h_buffer.write('''
+@end
+                   ''')
+    m_buffer.write('''
+@end
+                   ''')
+
+    return OrderedDict([("MachineDataModel.m", m_buffer.getvalue()),
+                        ("MachineDataModel.h", h_buffer.getvalue())])
+
+# Writes the functions registering the descriptors of each url the first time one of its methods
+# is called, and of the root responses the first time any url is used
+# Returns:
+#   (request_mappings, response_mappings, registrations, preludes), the names of the objects used
+#   by the descriptors, the code of the functions and the call to the registration function of
+#   each endpoint
+def print_lazy_registrations(endpoint_ir):
+    descriptor_names = SymbolRegistry("Descriptor")
+    function_names = SymbolRegistry("Function")
+    request_mappings = []
+    response_mappings = []
+    preludes = []
+    outfile = StringIO.StringIO()
+
+    groups = [(endpoint["url"], [endpoint], []) for endpoint in endpoint_ir["endpoints"]]
+    if endpoint_ir["root_responses"]:
+        groups.insert(0, (None, [], endpoint_ir["root_responses"]))
+
+    for (url, endpoints, roots) in groups:
+        if url is None:
+            name = function_names.claim("registerRootDescriptors", "the root responses")
+        else:
+            name = function_names.claim("register%sDescriptors" % underscore_to_camel(url), "`%s`" % url)
+            preludes.append("%s();\n" % name)
+
+        outfile.write("static void %s(void) {\n" % name)
+        if url is not None and endpoint_ir["root_responses"]:
+            outfile.write("registerRootDescriptors();\n")
+        outfile.write("static dispatch_once_t once;\n")
+        outfile.write("dispatch_once(&once, ^{\n")
+        outfile.write("RKObjectManager* manager = [RKObjectManager sharedManager];\n")
+        (requests, responses) = print_shard_setup(endpoints, roots, descriptor_names, outfile, lookup_mapping_accessor)
+        outfile.write("});\n}\n\n")
+        request_mappings += requests
+        response_mappings += responses
+
+    return (list(set(request_mappings)), list(set(response_mappings)), outfile.getvalue(), preludes)
+
+# Writes an accessor function per object mapping, building the mapping (and the mappings it
+# relates to) the first time it is called
+def print_lazy_mapping_accessors(parsed_requests, parsed_responses, graph, outfile):
+    accessors = [(d, "Request") for d in parsed_requests] + [(d, "Response") for d in parsed_responses]
+
+    for (d, kind) in accessors:
+        outfile.write("static RKObjectMapping* get%s%sMapping(void);\n" % (titlecase(d.var_name), kind))
+
+    for (objects, kind) in [(parsed_requests, "Request"), (parsed_responses, "Response")]:
+        # the accessors of objects relating to each other would wait on each other's
+        # dispatch_once forever, so the mappings of a cycle are built together by one function
+        names = set([d.var_name for d in objects])
+        groups = dict([(d.var_name, [d]) for d in objects])
+        for cycle in graph["cycles"]:
+            members = [d for d in objects if d.var_name in cycle]
+            if len(members) > 1:
+                for d in members:
+                    groups[d.var_name] = members
+
+        printed = set()
+        for d in objects:
+            group = groups[d.var_name]
+            if group[0].var_name in printed:
+                continue
+            printed.add(group[0].var_name)
+            if len(group) == 1:
+                print_lazy_mapping_accessor(d, kind, outfile)
+            else:
+                print_lazy_mapping_group(group, kind, outfile)
+
+# Writes the accessor building the mapping of d on first use
+def print_lazy_mapping_accessor(d, kind, outfile):
+    mapping_name = "%s%sMapping" % (d.var_name, kind)
+    outfile.write("\nstatic RKObjectMapping* get%s(void) {\n" % titlecase(mapping_name))
+    outfile.write("static RKObjectMapping* mapping = nil;\n")
+    outfile.write("static dispatch_once_t once;\n")
+    outfile.write("dispatch_once(&once, ^{\n")
+    if kind == "Response" and d.is_cached:
+        outfile.write("RKManagedObjectStore* managedObjectStore = sharedManagedObjectStore;\n")
+    print_related_mapping_lookups([d], kind, outfile)
+    if kind == "Request":
+        print_object_request_mapping(outfile, d)
+    else:
+        print_object_response_mapping(outfile, d)
+    outfile.write("mapping = %s;\n" % mapping_name)
+    outfile.write("});\n")
+    outfile.write("return mapping;\n}\n")
+
+# Writes the accessors of objects relating to each other. A single dispatch_once creates all of
+# their mappings before adding the relationships between them, and every accessor returns its
+# mapping from there.
+def print_lazy_mapping_group(group, kind, outfile):
+    builder = "build%s%sMappings" % (titlecase(group[0].var_name), kind)
+    outfile.write("\n")
+    for d in group:
+        outfile.write("static RKObjectMapping* lazy%s%sMapping = nil;\n" % (titlecase(d.var_name), kind))
+    outfile.write("\nstatic void %s(void) {\n" % builder)
+    outfile.write("static dispatch_once_t once;\n")
+    outfile.write("dispatch_once(&once, ^{\n")
+    if kind == "Response" and any([d.is_cached for d in group]):
+        outfile.write("RKManagedObjectStore* managedObjectStore = sharedManagedObjectStore;\n")
+    print_related_mapping_lookups(group, kind, outfile)
+    for d in group:
+        if kind == "Request":
+            print_object_request_mapping(outfile, d, False)
+        else:
+            print_object_response_mapping(outfile, d, False)
+    for d in group:
+        print_relationship_mappings(outfile, d, kind)
+    for d in group:
+        outfile.write("lazy%s%sMapping = %s%sMapping;\n" % (titlecase(d.var_name), kind, d.var_name, kind))
+    outfile.write("});\n}\n")
+
+    for d in group:
+        outfile.write("\nstatic RKObjectMapping* get%s%sMapping(void) {\n" % (titlecase(d.var_name), kind))
+        outfile.write("%s();\n" % builder)
+        outfile.write("return lazy%s%sMapping;\n}\n" % (titlecase(d.var_name), kind))
+
+# Looks up the mappings that the objects of group relate to, outside of the group itself
+def print_related_mapping_lookups(group, kind, outfile):
+    related = [d.var_name for d in group]
+    for d in group:
+        for r in d.subclasses:
+            if not r.object_name in related:
+                related.append(r.object_name)
+                related_name = "%s%sMapping" % (r.object_name, kind)
+                outfile.write("RKObjectMapping* %s = %s;\n" % (related_name, lookup_mapping_accessor(related_name)))
+
+# Writes the single file data model where setupMapping only sets up the object store and the
+# manager. Mappings and descriptors are built the first time a url is used (the --lazy flag).
+# Returns OrderedDict([(filename, contents), ...])
+def print_lazy_machine_data_model(endpoint_ir, store_setup, registrations, preludes, graph, mappings, parsed_requests, parsed_responses):
+    m_buffer = StringIO.StringIO()
+    h_buffer = StringIO.StringIO()
+
+    print_file_banner("MachineDataModel.h", h_buffer)
+    h_buffer.write('''
+#import <Foundation/Foundation.h>
+#import <RestKit/RestKit.h>
+
+@interface MachineDataModel : NSObject
+
+-(void)setupMapping;
+                   ''')
+
+    print_file_banner("MachineDataModel.m", m_buffer)
+    m_buffer.write('''
+#import "MachineDataModel.h"
+
+#import <RestKit/RestKit.h>
+#import <AFNetworking-TastyPie/AFNetworking+ApiKeyAuthentication.h>
+
+#import "AppModel.h"
+                   ''')
 
     m_buffer.write("\n")
     print_imports(mappings, m_buffer)
     m_buffer.write("\n")
+    m_buffer.write("static RKManagedObjectStore* sharedManagedObjectStore = nil;\n\n")
+
+    with run_metrics.phase("print object mappings"):
+        print_lazy_mapping_accessors(parsed_requests, parsed_responses, graph, m_buffer)
+
+    m_buffer.write("\n")
+    m_buffer.write(registrations)
     m_buffer.write('''
 @implementation MachineDataModel
 
 -(void)setupMapping {
-NSIndexSet *successCodes = RKStatusCodeIndexSetForClass(RKStatusCodeClassSuccessful);
-NSIndexSet *failCodes = RKStatusCodeIndexSetForClass(RKStatusCodeClassClientError);
-NSIndexSet *serverFailCodes = RKStatusCodeIndexSetForClass(RKStatusCodeClassServerError);
-NSIndexSet *redirectCodes = RKStatusCodeIndexSetForClass(RKStatusCodeClassRedirection);
+%s
+sharedManagedObjectStore = managedObjectStore;
 
+// Configure RestKit, the descriptors of a url are added the first time one of its methods is called
 
-// managed object manager
-NSError* error = nil;
-NSManagedObjectModel *managedObjectModel = [NSManagedObjectModel mergedModelFromBundles:nil];
-RKManagedObjectStore *managedObjectStore = [[RKManagedObjectStore alloc] initWithManagedObjectModel:managedObjectModel];
-BOOL success = RKEnsureDirectoryExistsAtPath(RKApplicationDataDirectory(), &error);
-if (! success) {
-    RKLogError(@"Failed to create Application Data Directory at path '%@': %@", RKApplicationDataDirectory(), error);
-}
-NSString *path = [RKApplicationDataDirectory() stringByAppendingPathComponent:DATABASE_FILE];
-NSPersistentStore *persistentStore = [managedObjectStore addSQLitePersistentStoreAtPath:path fromSeedDatabaseAtPath:nil withConfiguration:nil options:nil error:&error];
-if (! persistentStore) {
-    RKLogError(@"Failed adding persistent store at path '%@': %@", path, error);
+NSString* strBase = [NSString stringWithFormat:@"%%@%%@", BASE_URL, API_URL];
+NSURL* url = [NSURL URLWithString:strBase];
+RKObjectManager* manager = [RKObjectManager managerWithBaseURL:url];
+manager.requestSerializationMIMEType = RKMIMETypeJSON;
+manager.managedObjectStore = managedObjectStore;
 }
-[managedObjectStore createManagedObjectContexts];
 
-// RestKit object mappings
+''' % store_setup)
+
+    with run_metrics.phase("print methods from urls"):
+        print_methods_from_urls(endpoint_ir, False, m_buffer, preludes)
+        m_buffer.write("\n\n")
+
+        print_methods_from_urls(endpoint_ir, True, h_buffer)
+
+    h_buffer.write('''
+@end
+                   ''')
+    m_buffer.write('''
+@end
+                   ''')
+
+    return OrderedDict([("MachineDataModel.m", m_buffer.getvalue()),
+                        ("MachineDataModel.h", h_buffer.getvalue())])
+
+# Writes the setup method bodies of every shard (see shard_endpoints) and of the root responses,
+# keyed by None. Descriptor names are unique across shards.
+# Returns:
+#   (request_mappings, response_mappings, OrderedDict([(shard name, (body, object names)), ...]))
+def print_shard_setups(shards, root_responses):
+    descriptor_names = SymbolRegistry("Descriptor")
+    request_mappings = []
+    response_mappings = []
+    setups = OrderedDict()
+
+    groups = [(name, endpoints, []) for (name, endpoints) in shards.items()]
+    if root_responses:
+        groups.append((None, [], root_responses))
+
+    for (name, endpoints, roots) in groups:
+        outfile = StringIO.StringIO()
+        (requests, responses) = print_shard_setup(endpoints, roots, descriptor_names, outfile)
+        request_mappings += requests
+        response_mappings += responses
+        setups[name] = (outfile.getvalue(), list(set(requests + responses)))
+
+    return (list(set(request_mappings)), list(set(response_mappings)), setups)
+
+# Writes a data model split in categories of MachineDataModel, so that Xcode compiles them in
+# parallel and only recompiles the categories whose urls changed:
+#   MachineDataModel+ObjectMappings creates every object mapping once
+#   MachineDataModel+<Shard>Endpoints adds the descriptors and defines the methods of a shard
+#   MachineDataModel only sets up the object store and manager and calls the shards
+# MachineDataModel.h imports every shard header, so the public methods are unchanged
+# Returns OrderedDict([(filename, contents), ...])
+def print_sharded_machine_data_model(shards, store_setup, shard_setups, symbols, graph, parsed_requests, parsed_responses):
+    files = OrderedDict()
+    categories = ["%sEndpoints" % name for name in shards.keys()]
+
+    h_buffer = StringIO.StringIO()
+    print_file_banner("MachineDataModel.h", h_buffer)
+    h_buffer.write('''
+#import <Foundation/Foundation.h>
+#import <RestKit/RestKit.h>
+
+@interface MachineDataModel : NSObject
+
+-(void)setupMapping;
+
+@end
+
+''')
+    for category in categories:
+        h_buffer.write('#import "MachineDataModel+%s.h"\n' % category)
+    files["MachineDataModel.h"] = h_buffer.getvalue()
+
+    m_buffer = StringIO.StringIO()
+    print_file_banner("MachineDataModel.m", m_buffer)
+    m_buffer.write('''
+#import "MachineDataModel.h"
+#import "MachineDataModel+ObjectMappings.h"
+
+#import <RestKit/RestKit.h>
+
+@implementation MachineDataModel
+
+-(void)setupMapping {
+%s
+// Configure RestKit to handle requests and responses
+
+NSString* strBase = [NSString stringWithFormat:@"%%@%%@", BASE_URL, API_URL];
+NSURL* url = [NSURL URLWithString:strBase];
+RKObjectManager* manager = [RKObjectManager managerWithBaseURL:url];
+manager.requestSerializationMIMEType = RKMIMETypeJSON;
+manager.managedObjectStore = managedObjectStore;
 
+NSDictionary* mappings = [self objectMappingsWithStore:managedObjectStore];
+''' % store_setup)
+    for category in categories:
+        m_buffer.write("[self setup%sWithMappings:mappings manager:manager];\n" % category)
+    if None in shard_setups:
+        m_buffer.write("\n")
+        m_buffer.write(shard_setups[None][0])
+    m_buffer.write("}\n\n@end\n")
+    files["MachineDataModel.m"] = m_buffer.getvalue()
+
+    # object mappings
+    with run_metrics.phase("print object mappings"):
+        h_buffer = StringIO.StringIO()
+        print_file_banner("MachineDataModel+ObjectMappings.h", h_buffer)
+        h_buffer.write('''
+#import "MachineDataModel.h"
+
+@interface MachineDataModel (ObjectMappings)
+
+-(NSDictionary*)objectMappingsWithStore:(RKManagedObjectStore*)managedObjectStore;
+
+@end
+''')
+        files["MachineDataModel+ObjectMappings.h"] = h_buffer.getvalue()
+
+        m_buffer = StringIO.StringIO()
+        print_file_banner("MachineDataModel+ObjectMappings.m", m_buffer)
+        m_buffer.write('''
+#import "MachineDataModel+ObjectMappings.h"
+
+#import <RestKit/RestKit.h>
+
+''')
+        print_imports(build_object_list([d.var_name for d in parsed_requests + parsed_responses], symbols, graph), m_buffer)
+        m_buffer.write('''
+@implementation MachineDataModel (ObjectMappings)
+
+-(NSDictionary*)objectMappingsWithStore:(RKManagedObjectStore*)managedObjectStore {
 ''')
+        print_request_mapping(parsed_requests, m_buffer)
+        print_response_mapping(parsed_responses, m_buffer)
+        entries = ['@"%sRequestMapping" : %sRequestMapping' % (d.var_name, d.var_name) for d in parsed_requests] + \
+                  ['@"%sResponseMapping" : %sResponseMapping' % (d.var_name, d.var_name) for d in parsed_responses]
+        m_buffer.write("return @{%s};\n}\n\n@end\n" % ",\n         ".join(entries))
+        files["MachineDataModel+ObjectMappings.m"] = m_buffer.getvalue()
+
+    # shards
+    with run_metrics.phase("print methods from urls"):
+        for (name, category) in zip(shards.keys(), categories):
+            shard_ir = { "endpoints" : shards[name],
+                         "root_responses" : [] }
+            (setup, names) = shard_setups[name]
+            objects = build_object_list(names, symbols, graph)
+            selector = "-(void)setup%sWithMappings:(NSDictionary*)mappings manager:(RKObjectManager*)manager" % category
+
+            h_buffer = StringIO.StringIO()
+            print_file_banner("MachineDataModel+%s.h" % category, h_buffer)
+            h_buffer.write('''
+#import "MachineDataModel.h"
+
+''')
+            for object_name in objects:
+                h_buffer.write("@class %s;\n" % titlecase(object_name))
+            h_buffer.write("\n@interface MachineDataModel (%s)\n\n%s;\n" % (category, selector))
+            print_methods_from_urls(shard_ir, True, h_buffer)
+            h_buffer.write("\n@end\n")
+            files["MachineDataModel+%s.h" % category] = h_buffer.getvalue()
+
+            m_buffer = StringIO.StringIO()
+            print_file_banner("MachineDataModel+%s.m" % category, m_buffer)
+            m_buffer.write('''
+#import "MachineDataModel+%s.h"
+
+#import <RestKit/RestKit.h>
+#import <AFNetworking-TastyPie/AFNetworking+ApiKeyAuthentication.h>
+
+#import "AppModel.h"
+
+''' % category)
+            print_imports(objects, m_buffer)
+            m_buffer.write("\n@implementation MachineDataModel (%s)\n\n%s {\n" % (category, selector))
+            m_buffer.write(setup)
+            m_buffer.write("}\n\n")
+            print_methods_from_urls(shard_ir, False, m_buffer)
+            m_buffer.write("\n@end\n")
+            files["MachineDataModel+%s.m" % category] = m_buffer.getvalue()
+
+    return files
+
+def generate(schema, username_field, project_dir, overwrite=False, workers=1, templates=None, previous=None, cache_dir=None, check=False, shard=False, lazy=False, core_data_model=False):
+    """
+    Generates the Machine/ and Objects/ folders for a schema into project_dir without any prompt,
+    so that build tools can call the generator in-process, once per schema and target.
+
+    schema is either the parsed JSON schema or the path of a schema file
+    username_field is the user field sent as the username for basic and tastypie authentication
+    overwrite replaces existing object files whose contents changed (the -f flag)
+    workers is the number of threads writing object files (the --jobs flag)
+    templates is a directory containing a custom manticom.h.template
+    previous is the value returned by an earlier run for the same target, object files whose
+    definitions did not change since then are neither rendered nor compared again
+    cache_dir is a directory in which parsed schemas are kept between processes, a schema that
+    was already parsed by the same generator is loaded from there instead (the --cache-dir flag)
+    check renders everything in memory and compares it with project_dir without touching the
+    disk, the files that would be added, changed or deleted are reported (the --check flag)
+    shard splits the data model into a category per url prefix (the --shard flag)
+    lazy builds mappings and descriptors the first time a url is used instead of in setupMapping,
+    it cannot be combined with shard (the --lazy flag)
+    core_data_model also writes the Core Data model of the cached objects (the --core-data-model flag)
+
+    Returns the state of this run, to be passed as previous to the next one. After a check,
+    is_outdated tells whether project_dir differs from the generated files.
+    """
+    global field, force_overwrite, dry_run, jobs, template_dir, run_template_values, run_metrics
+    if shard and lazy:
+        raise ValueError("Lazy mappings cannot be combined with a sharded data model")
+    run_metrics = GenerationMetrics()
+    field = username_field
+    force_overwrite = overwrite
+    dry_run = check
+    jobs = workers
+    if templates:
+        template_dir = os.path.join(templates, "")
+    else:
+        template_dir = DEFAULT_TEMPLATE_DIR
+    run_template_values = None # project name and date are recomputed for every run
+
+    # schema files are streamed, the raw JSON is never held in memory as a whole
+    if cache_dir:
+        model = load_schema_model(schema, cache_dir)
+    else:
+        model = build_schema_model(schema)
+    endpoint_ir = model["endpoint_ir"]
+    symbols = model["symbols"]
+    graph = model["graph"]
+
+    models_dir = project_dir + "/Machine/"
+
+    if not os.path.exists(models_dir) and not dry_run:
+        os.makedirs(models_dir)
+
+    logging.info("Generating into %s" % models_dir)
+
+    # attach the objects indexed by the symbol table to the operations
+    with run_metrics.phase("resolve endpoints"):
+        resolve_endpoints(endpoint_ir, symbols)
+
+    # print url mapping buffer
+    with run_metrics.phase("print url mappings"):
+        if shard:
+            shards = shard_endpoints(endpoint_ir)
+            (request_mappings, response_mappings, shard_setups) = print_shard_setups(shards, endpoint_ir["root_responses"])
+        elif lazy:
+            (request_mappings, response_mappings, registrations, preludes) = print_lazy_registrations(endpoint_ir)
+        else:
+            mapping_buffer = StringIO.StringIO()
+            (request_mappings, response_mappings) = print_url_mappings(endpoint_ir, mapping_buffer)
+
+    # build request and response buffer
+    with run_metrics.phase("build object list"):
+        request_mappings = build_object_list(request_mappings, symbols, graph)
+        response_mappings = build_object_list(response_mappings, symbols, graph)
+        mappings = build_object_list(request_mappings + response_mappings, symbols, graph)
 
     # parse the original objects schema into an expanded format
-    parsed_requests = parse_objects_from_list(expanded_objects, request_mappings)
-    parsed_responses = parse_objects_from_list(expanded_objects, response_mappings)
+    parsed_requests = parse_objects_from_list(symbols, request_mappings)
+    parsed_responses = parse_objects_from_list(symbols, response_mappings)
 
     assert len(parsed_requests) == len(request_mappings)
     assert len(parsed_responses) == len(response_mappings)
@@ -1247,46 +3260,214 @@ if (! persistentStore) {
     # which files have been added or deleted
 
     # need to pass path here.......
-    create_object_files_at_project_dir_from_internal_schema(project_dir, parsed_requests + parsed_responses)
+    previous_objects = previous["objects"] if previous else None
+    with run_metrics.phase("create object files"):
+        emitted_objects = create_object_files_at_project_dir_from_internal_schema(project_dir, parsed_requests + parsed_responses, previous_objects)
+
+    store_setup = print_managed_object_store_setup(endpoint_ir["managed_object_cache"], parsed_requests + parsed_responses)
+    if shard:
+        files = print_sharded_machine_data_model(shards, store_setup, shard_setups, symbols, graph, parsed_requests, parsed_responses)
+    elif lazy:
+        files = print_lazy_machine_data_model(endpoint_ir, store_setup, registrations, preludes, graph, mappings, parsed_requests, parsed_responses)
+    else:
+        files = print_machine_data_model(endpoint_ir, store_setup, mapping_buffer, mappings, parsed_requests, parsed_responses)
+
+    with run_metrics.phase("write machine data model"):
+        for (filename, contents) in files.items():
+            log_file_status(filename, write_file_if_changed(models_dir + filename, contents))
+
+        # shards of urls that were removed, or of a previous sharded run
+        if os.path.exists(models_dir):
+            delete_stale_files(models_dir, [filename for filename in os.listdir(models_dir)
+                                            if filename.startswith("MachineDataModel+") and not filename in files])
+
+    if core_data_model:
+        with run_metrics.phase("write core data model"):
+            model_buffer = StringIO.StringIO()
+            if print_core_data_model(parsed_requests + parsed_responses, model_buffer):
+                model_path = models_dir + CORE_DATA_MODEL_PATH
+                if not os.path.exists(os.path.dirname(model_path)) and not dry_run:
+                    os.makedirs(os.path.dirname(model_path))
+                log_file_status(CORE_DATA_MODEL_PATH, write_file_if_changed(model_path, model_buffer.getvalue()))
+            else:
+                logging.info("No cached objects, the Core Data model is not written")
 
-    # output mappings for objects that are referenced by requests and responses
-    print_request_mapping(parsed_requests, m_buffer)
-    print_response_mapping(parsed_responses, m_buffer)
+    return { "objects" : emitted_objects,
+             "metrics" : run_metrics }
 
-    m_buffer.write(mapping_buffer.getvalue())
-    m_buffer.write("}\n\n")
+def is_outdated(state):
+    """
+    Whether a run found files to add, change or delete, see generate(..., check=True)
+    """
+    return any([state["metrics"].counts.get("files %s" % status) for status in OUTDATED_FILE_STATUSES])
+
+def get_modification_times(paths):
+    times = {}
+    for path in paths:
+        try:
+            times[path] = os.stat(path).st_mtime
+        except OSError:
+            times[path] = None
+    return times
+
+# Evicts the parsed definitions, rendered objects and derived names that weren't used since the
+# previous call, see RunCache
+def prune_caches():
+    for cache in [parsed_url_cache, parsed_object_cache, rendered_object_cache] + interned_names.values():
+        cache.prune()
+
+def watch(schema, username_field, project_dir, overwrite=False, workers=1, templates=None, interval=0.5, on_generate=None, cache_dir=None, shard=False, lazy=False, core_data_model=False):
+    """
+    Keeps the generator resident and regenerates project_dir whenever the schema file or the
+    object file template changes, until interrupted.
+
+    Url and object definitions are cached by content, so only the modified entries are parsed
+    again, and the cached entries the latest run didn't use are evicted. Object files are only emitted for objects whose definition changed or that became
+    referenced through the dependency graph, and files of objects that are no longer referenced
+    are removed. on_generate is called with the state of every successful run. The other
+    arguments have the same meaning as for generate.
+    """
+    template = os.path.join(templates or DEFAULT_TEMPLATE_DIR, template_file)
+    watched = [schema, template]
+    times = None
+    state = None
+
+    logging.info("Watching %s, press Ctrl-C to stop" % schema)
+    try:
+        while True:
+            current_times = get_modification_times(watched)
+            if current_times != times:
+                if times and current_times[template] != times[template]:
+                    compiled_templates.pop(os.path.realpath(template), None)
+                    # every object file has to be written again with the new template
+                    state = None
+                times = current_times
+                try:
+                    state = generate(schema, username_field, project_dir, overwrite=overwrite,
+                                     workers=workers, templates=templates, previous=state, cache_dir=cache_dir, shard=shard, lazy=lazy,
+                                     core_data_model=core_data_model)
+                    logging.info("Regenerated %s" % project_dir)
+                    prune_caches()
+                    if on_generate:
+                        on_generate(state)
+                except Exception:
+                    # a schema being saved may be incomplete, wait for the next change
+                    logging.exception("Failed to regenerate %s" % project_dir)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def generate_batch(targets, overwrite=False, workers=1, templates=None, cache_dir=None, check=False, shard=False, lazy=False, core_data_model=False):
+    """
+    Generates several schema/target pairs in one process. targets is a list of
+    (schema, username_field, project_dir) tuples, with the same meaning as for generate.
 
-    # print headers
-    print_methods_from_urls(schema["urls"], expanded_objects, False, m_buffer)
-    m_buffer.write("\n\n")
+    Object definitions shared between schemas (identical name and content) are parsed and
+    rendered once, so the work grows with the number of unique objects rather than with
+    the number of schemas times objects.
 
-    # print body definitions for those headers (DataModel.h)
-    print_methods_from_urls(schema["urls"], expanded_objects, True, h_buffer)
+    Returns the state of every run, in the order of targets
+    """
+    return [generate(schema, username_field, project_dir, overwrite=overwrite, workers=workers, templates=templates, cache_dir=cache_dir, check=check, shard=shard, lazy=lazy, core_data_model=core_data_model)
+            for (schema, username_field, project_dir) in targets]
 
-    h_buffer.write('''
-@end
-                   ''')
-    m_buffer.write('''
-@end
-                   ''')
+# Batch file:
+# [
+#   {"schema" : "consumer.json", "username_field" : "username", "project_dir" : "Consumer"},
+#   {"schema" : "merchant.json", "username_field" : "email", "project_dir" : "Merchant"}
+# ]
+def load_batch(filename):
+    f = open(filename, "r")
+    batch = json.loads(f.read())
+    f.close()
+    return [(target["schema"], target["username_field"], target["project_dir"]) for target in batch]
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Generates RestKit 0.20 mappings and objects from a Manticom JSON schema.")
+    parser.add_argument("schema", nargs="?", help="path of the JSON schema")
+    parser.add_argument("-u", "--username-field",
+                        help="user field sent as the username for authentication, e.g. username or email")
+    parser.add_argument("-o", "--project-dir",
+                        help="directory in which the Machine and Objects folders are generated")
+    parser.add_argument("-b", "--batch", metavar="FILE",
+                        help="JSON list of {schema, username_field, project_dir} targets generated in one run")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="overwrite existing object files whose contents changed")
+    parser.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+                        help="write object files using N worker threads")
+    parser.add_argument("-t", "--template-dir",
+                        help="directory containing a custom manticom.h.template")
+    parser.add_argument("-w", "--watch", action="store_true",
+                        help="keep running and regenerate whenever the schema or template changes")
+    parser.add_argument("-s", "--shard", action="store_true",
+                        help="split MachineDataModel into a category per url prefix that Xcode compiles separately")
+    parser.add_argument("-l", "--lazy", action="store_true",
+                        help="build mappings and descriptors the first time a url is used instead of at launch")
+    parser.add_argument("-m", "--core-data-model", action="store_true",
+                        help="also write the Core Data model of the cached objects, with indexed primary attributes")
+    parser.add_argument("--check", action="store_true",
+                        help="compare the generated files with the project without writing anything, "
+                             "exit with 1 if files are missing, out of date or stale")
+    parser.add_argument("-c", "--cache-dir",
+                        help="keep parsed schemas in this directory, unchanged schemas are not parsed again")
+    parser.add_argument("-p", "--profile", action="store_true",
+                        help="report wall time and peak memory growth per phase and counts of the work done")
+    parser.add_argument("--profile-output", metavar="FILE",
+                        help="also dump cProfile statistics to FILE, readable with pstats")
+    args = parser.parse_args(argv)
+
+    if args.jobs < 1:
+        parser.error("--jobs requires a positive number of workers")
+
+    outdated = []
+
+    def report(state):
+        if args.profile or args.profile_output:
+            print state["metrics"].report()
+        if args.check and is_outdated(state):
+            outdated.append(state)
+
+    def run():
+        if args.batch:
+            for state in generate_batch(load_batch(args.batch), overwrite=args.force, workers=args.jobs,
+                                        templates=args.template_dir, cache_dir=args.cache_dir, check=args.check, shard=args.shard, lazy=args.lazy,
+                                        core_data_model=args.core_data_model):
+                report(state)
+        elif args.watch:
+            watch(args.schema, args.username_field, args.project_dir, overwrite=args.force,
+                  workers=args.jobs, templates=args.template_dir, on_generate=report, cache_dir=args.cache_dir, shard=args.shard, lazy=args.lazy,
+                  core_data_model=args.core_data_model)
+        else:
+            report(generate(args.schema, args.username_field, args.project_dir, overwrite=args.force,
+                            workers=args.jobs, templates=args.template_dir, cache_dir=args.cache_dir, check=args.check, shard=args.shard, lazy=args.lazy,
+                            core_data_model=args.core_data_model))
+
+    if args.batch:
+        if args.schema or args.username_field or args.project_dir or args.watch:
+            parser.error("--batch cannot be combined with a schema, --username-field, --project-dir or --watch")
+    elif args.watch and args.check:
+        parser.error("--check cannot be combined with --watch")
+    elif not (args.schema and args.username_field and args.project_dir):
+        parser.error("a schema, --username-field and --project-dir are required")
+
+    if args.shard and args.lazy:
+        parser.error("--lazy cannot be combined with --shard")
+
+    if args.profile_output:
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(run)
+        finally:
+            profiler.dump_stats(args.profile_output)
+    else:
+        run()
+
+    if outdated:
+        logging.error("The generated files are out of date, regenerate them without --check")
+        return 1
+    return 0
 
-    m_buffer.close()
-    h_buffer.close()
-
-
-# supports two formats
-# script.py -f filename
-# script.py filename
-if len(sys.argv) > 4 or len(sys.argv) <= 1:
-    print "Usage: " + sys.argv[0] + " <filename> <authenticationfield>"
-    print "       " + sys.argv[0] + " -f <filename> <authenticationfield>"
-    print "   where -f forces existing files to be overwritten"
-else:
-    i = 1
-    if sys.argv[1] == "-f":
-        force_overwrite = True
-        i = 2
-        if len(sys.argv) != 3:
-            print "-f force argument without a filename"
-
-    main_script(sys.argv[i])
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,222 @@
+# Manticore Communication benchmark
+#
+# Synthesizes schemas of tunable size and shape, times every phase of the generator on them
+# and records the results so that runs can be compared for regressions.
+#
+# Example:
+#
+# python manticom_benchmark.py --objects 100,500,1000 --output results.json
+# python manticom_benchmark.py --objects 100,500,1000 --compare results.json
+#
+# Timing several object counts in one run shows how every phase scales: a phase whose time
+# grows much faster than the object count is quadratic.
+
+import sys
+import os
+import json
+import logging
+import argparse
+import random
+import shutil
+import tempfile
+import platform
+import StringIO
+from collections import OrderedDict
+from datetime import datetime
+from timeit import default_timer
+
+import manticom
+
+PRIMITIVE_TYPES = ["string", "integer", "boolean", "datetime", "float", "text"]
+
+PHASES = ["check_schema",
+          "parse_urls",
+          "parse_all_objects",
+          "build_object_list",
+          "create_object_files",
+          "print_methods_from_urls"]
+
+# Output:
+# {"urls" : [...], "objects" : [{"$obj0" : {...}}, ...]}
+#
+# Objects are defined in order, every object at nesting level L > 0 references the object
+# defined just before it (level L - 1), so reference chains are `depth` objects long.
+# `arrays` is the fraction of those references that are array relationships.
+# Every url uses `methods` of get, post, put, patch and delete on a single object.
+def synthesize_schema(objects=100, attributes=8, depth=3, arrays=0.3, urls=100, methods=3, seed=0):
+    rand = random.Random(seed)
+    schema = OrderedDict([("urls", []), ("objects", [])])
+
+    for i in range(objects):
+        obj = OrderedDict()
+        if i % 2 == 0:
+            obj["#meta"] = "cached"
+        obj["id"] = "integer,primary"
+        for j in range(attributes - 1):
+            attr_type = PRIMITIVE_TYPES[(i + j) % len(PRIMITIVE_TYPES)]
+            if rand.random() < 0.2:
+                attr_type += ",optional"
+            obj["field_%d" % j] = attr_type
+
+        if i % (depth + 1) > 0:
+            if rand.random() < arrays:
+                obj["children"] = "array,$obj%d" % (i - 1)
+            else:
+                obj["parent"] = "$obj%d" % (i - 1)
+
+        schema["objects"].append({"$obj%d" % i : obj})
+
+    schema["objects"].append({"$filter" : OrderedDict([("search", "string,optional"), ("page", "integer,optional")])})
+
+    all_methods = ["get", "post", "put", "patch", "delete"]
+    for i in range(urls):
+        name = "$obj%d" % rand.randrange(objects)
+        url = OrderedDict([("url", "resource_%d/:id/" % i), ("doc", "Synthetic resource %d" % i)])
+        for method in all_methods[0:methods]:
+            if method == "get":
+                url[method] = {"prototype" : name, "parameters" : "$filter",
+                               "response" : OrderedDict([("200+", name), ("keyPath", "objects")])}
+            elif method == "delete":
+                url[method] = {"prototype" : name, "#meta" : "tastypieauth"}
+            else:
+                url[method] = {"request" : name, "response" : name, "#meta" : "basicauth"}
+        schema["urls"].append(url)
+
+    return schema
+
+# Runs every phase of manticom.generate on schema, writing into project_dir
+# Returns {phase : seconds}
+def time_phases(schema, project_dir):
+    times = OrderedDict()
+
+    def timed(phase, function, *args):
+        start = default_timer()
+        result = function(*args)
+        times[phase] = times.get(phase, 0.0) + default_timer() - start
+        return result
+
+    # start from empty caches so every phase does its full work
+    manticom.parsed_object_cache.clear()
+    manticom.parsed_url_cache.clear()
+    manticom.rendered_object_cache.clear()
+    manticom.force_overwrite = True
+
+    timed("check_schema", manticom.check_schema, schema)
+    endpoint_ir = timed("parse_urls", manticom.parse_urls, schema["urls"])
+    expanded_objects = timed("parse_all_objects", manticom.parse_all_objects, schema["objects"])
+
+    # symbol table and endpoint resolution are needed by the later phases, they are counted
+    # with the url parsing
+    symbols = timed("parse_urls", manticom.build_symbol_table, expanded_objects, endpoint_ir)
+    timed("parse_urls", manticom.resolve_endpoints, endpoint_ir, symbols)
+    (request_mappings, response_mappings) = timed("parse_urls", manticom.print_url_mappings, endpoint_ir, StringIO.StringIO())
+
+    graph = timed("build_object_list", manticom.build_dependency_graph, symbols)
+    request_mappings = timed("build_object_list", manticom.build_object_list, request_mappings, symbols, graph)
+    response_mappings = timed("build_object_list", manticom.build_object_list, response_mappings, symbols, graph)
+
+    parsed = manticom.parse_objects_from_list(symbols, request_mappings) + manticom.parse_objects_from_list(symbols, response_mappings)
+    timed("create_object_files", manticom.create_object_files_at_project_dir_from_internal_schema, project_dir, parsed)
+
+    timed("print_methods_from_urls", manticom.print_methods_from_urls, endpoint_ir, False, StringIO.StringIO())
+    timed("print_methods_from_urls", manticom.print_methods_from_urls, endpoint_ir, True, StringIO.StringIO())
+
+    return times
+
+# Times every phase `repeat` times and keeps the fastest run of each phase
+def benchmark(params, repeat):
+    schema = synthesize_schema(**params)
+    best = OrderedDict()
+
+    for i in range(repeat):
+        project_dir = tempfile.mkdtemp(prefix="manticom-benchmark-")
+        try:
+            times = time_phases(schema, project_dir)
+        finally:
+            shutil.rmtree(project_dir)
+
+        for phase in PHASES:
+            if not phase in best or times[phase] < best[phase]:
+                best[phase] = times[phase]
+
+    return best
+
+def print_results(runs):
+    print "%-32s" % "objects/urls" + "".join(["%14s" % phase[0:13] for phase in PHASES])
+    for run in runs:
+        label = "%d/%d" % (run["params"]["objects"], run["params"]["urls"])
+        print "%-32s" % label + "".join(["%13.4fs" % run["phases"][phase] for phase in PHASES])
+
+# Compares runs with the runs of a previous results file that used the same parameters
+# Returns the regressions as [(params, phase, baseline seconds, seconds)]
+def compare_results(runs, baseline, tolerance):
+    regressions = []
+    for run in runs:
+        for old_run in baseline["runs"]:
+            if old_run["params"] != run["params"]:
+                continue
+            for phase in PHASES:
+                old_time = old_run["phases"].get(phase)
+                # ignore phases too fast to be measured reliably
+                if old_time and run["phases"][phase] > 0.001 and run["phases"][phase] > old_time * (1 + tolerance):
+                    regressions.append((run["params"], phase, old_time, run["phases"][phase]))
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Times every generator phase on synthesized schemas.")
+    parser.add_argument("--objects", default="100,500,1000",
+                        help="comma separated object counts, one benchmark per count")
+    parser.add_argument("--urls", type=int, default=None,
+                        help="number of urls, defaults to the object count")
+    parser.add_argument("--attributes", type=int, default=8, help="attributes per object")
+    parser.add_argument("--depth", type=int, default=3, help="length of object reference chains")
+    parser.add_argument("--arrays", type=float, default=0.3,
+                        help="fraction of object references that are array relationships")
+    parser.add_argument("--methods", type=int, default=3, choices=range(1, 6),
+                        help="methods per url among get, post, put, patch and delete")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark, the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", metavar="FILE", help="write the results as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="compare with the results of a previous --output")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="slowdown allowed by --compare before a phase is reported, 0.25 is 25%%")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR)
+
+    runs = []
+    for objects in [int(n) for n in args.objects.split(",")]:
+        params = OrderedDict([("objects", objects),
+                              ("attributes", args.attributes),
+                              ("depth", args.depth),
+                              ("arrays", args.arrays),
+                              ("urls", args.urls if args.urls is not None else objects),
+                              ("methods", args.methods),
+                              ("seed", args.seed)])
+        runs.append({ "params" : params,
+                      "phases" : benchmark(params, args.repeat) })
+
+    print_results(runs)
+
+    if args.output:
+        f = open(args.output, "w")
+        json.dump({ "date" : datetime.now().isoformat(),
+                    "python" : platform.python_version(),
+                    "runs" : runs }, f, indent=2)
+        f.close()
+
+    if args.compare:
+        f = open(args.compare, "r")
+        baseline = json.loads(f.read())
+        f.close()
+
+        regressions = compare_results(runs, baseline, args.tolerance)
+        for (params, phase, old_time, new_time) in regressions:
+            print "Regression in %s with %d objects: %.4fs -> %.4fs" % (phase, params["objects"], old_time, new_time)
+        if regressions:
+            return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,460 @@
+import unittest
+import json
+import logging
+import os
+import shutil
+import tempfile
+import StringIO
+
+import manticom
+
+class JSONStreamReaderTest(unittest.TestCase):
+
+    DOCUMENT = '{"urls" : [2.5, 1, 1e10, -0.25, 1E-3, 10, "a", true, null, {"b" : [0.5]}], "objects" : []}'
+
+    def read_document(self, text, chunk_size):
+        reader = manticom.JSONStreamReader(StringIO.StringIO(text), chunk_size)
+        document = {}
+        reader.expect("{")
+        while reader.peek() != "}":
+            if document:
+                reader.expect(",")
+            key = reader.decode()
+            reader.expect(":")
+            values = []
+            reader.expect("[")
+            while reader.peek() != "]":
+                if values:
+                    reader.expect(",")
+                values.append(reader.decode())
+            reader.expect("]")
+            document[key] = values
+        reader.expect("}")
+        return document
+
+    def test_decode_at_every_chunk_size(self):
+        expected = json.loads(self.DOCUMENT)
+        for chunk_size in range(1, len(self.DOCUMENT) + 1):
+            self.assertEqual(self.read_document(self.DOCUMENT, chunk_size), expected, "chunk size %d" % chunk_size)
+
+# a schema using every kind of url and object definition
+SCHEMA = {"urls" : [{"keyPath" : "meta", "200+" : "$MCMeta"},
+                    {"keyPath" : "error", "400+" : "$error"},
+                    {"url" : "users/:username/",
+                     "get" : {"#meta" : "conditional,coalesced", "prototype" : "$user", "response" : "$user"},
+                     "patch" : {"prototype" : "$user", "request" : "$userUpdate", "response" : "$user"}},
+                    {"url" : "posts/",
+                     "get" : {"parameters" : "$postFilter", "response" : {"200+" : "$post", "keyPath" : "objects"},
+                              "#meta" : "paginated,prefetch", "pageSize" : 50,
+                              "fieldsParameter" : "fields", "expandParameter" : "expand"},
+                     "post" : {"#meta" : "bulk", "batchSize" : 100, "request" : "$postCreate", "response" : {"201" : "$post"}}},
+                    {"url" : "comments/",
+                     "get" : {"response" : {"200+" : "$comment", "keyPath" : "objects"}}}],
+          "objects" : [{"$MCMeta" : {"limit" : "integer", "next" : "string", "offset" : "integer"}},
+                       {"$error" : {"error_message" : "string"}},
+                       {"$user" : {"#meta" : "cached", "username" : "string,primary", "email" : "string"}},
+                       {"$userUpdate" : {"email" : "string"}},
+                       {"$postFilter" : {"author" : "string,optional"}},
+                       {"$post" : {"#meta" : "cached", "#indexes" : ["title,id"], "id" : "integer,primary",
+                                   "title" : "string", "author" : "$user"}},
+                       {"$postCreate" : {"title" : "string"}},
+                       {"$comment" : {"#meta" : "cached", "id" : "integer,primary", "text" : "string"}}]}
+
+OBJECT_FILES = sorted(["%s.%s" % (name, extension) for name in ["MCMeta", "Error", "User", "UserUpdate", "Post", "PostCreate", "Comment"]
+                                                   for extension in ["h", "m"]])
+
+# user and post reference each other
+CYCLIC_SCHEMA = {"urls" : [{"url" : "posts/", "get" : {"response" : "$post"}}],
+                 "objects" : [{"$tag" : {"name" : "string,primary"}},
+                              {"$user" : {"username" : "string,primary", "posts" : "array,$post"}},
+                              {"$post" : {"id" : "integer,primary", "author" : "$user", "tags" : "array,$tag"}}]}
+
+# generates schemas into a temporary project directory, the warnings and errors logged meanwhile
+# are collected in self.log
+class GenerationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.project_dir = tempfile.mkdtemp()
+        self.log = manticom.LogCapture()
+        logging.getLogger().addHandler(self.log)
+
+    def tearDown(self):
+        logging.getLogger().removeHandler(self.log)
+        shutil.rmtree(self.project_dir)
+
+    def logged(self, text):
+        return [message for (level, message) in self.log.messages if text in message]
+
+    def generate(self, schema, **kwargs):
+        return manticom.generate(schema, "username", self.project_dir, overwrite=True, **kwargs)
+
+    def read(self, path):
+        f = open(os.path.join(self.project_dir, path), "r")
+        contents = f.read()
+        f.close()
+        return contents
+
+class PaginationTest(GenerationTestCase):
+
+    SCHEMA = {"urls" : [{"keyPath" : "meta", "200+" : "$MCMeta"},
+                        {"url" : "posts/",
+                         "get" : {"parameters" : "$postFilter",
+                                  "response" : {"200+" : "$post", "keyPath" : "objects"}}}],
+              "objects" : [{"$MCMeta" : {"limit" : "integer", "next" : "string", "offset" : "integer"}},
+                           {"$postFilter" : {"page" : "string", "offset" : "integer,optional"}},
+                           {"$post" : {"id" : "integer,primary", "title" : "string"}}]}
+
+    def test_page_arguments_do_not_collide_with_parameters(self):
+        self.generate(self.SCHEMA)
+        header = self.read("Machine/MachineDataModel.h")
+
+        self.assertIn("-(BOOL) getNextPostsPageWithPage:(NSString*)page pageResult:(RKMappingResult*)pageResult success:", header)
+        self.assertIn("-(void) getPostsPageWithPage:(NSString*)page offset:(NSNumber*)offset limit:(NSNumber*)limit success:", header)
+        self.assertEqual(header.count("offset:"), 2) # getAll and getPostsPage
+        body = self.read("Machine/MachineDataModel.m")
+        self.assertEqual(body.count('forKey:@"offset"];'), 2)
+
+    def test_page_methods(self):
+        self.generate(SCHEMA)
+        header = self.read("Machine/MachineDataModel.h")
+        body = self.read("Machine/MachineDataModel.m")
+
+        self.assertIn("// 50 objects per page unless a limit is given\n-(void) getPostsPageWithAuthor:(NSString*)author offset:(NSNumber*)offset limit:(NSNumber*)limit success:", header)
+        self.assertIn("-(BOOL) getNextPostsPageWithAuthor:(NSString*)author pageResult:(RKMappingResult*)pageResult success:", header)
+        self.assertIn("limit = @50;", body)
+        self.assertIn("prefetchedPages", body)
+        # comments/ is a list url under `objects` and the schema maps the Tastypie meta
+        self.assertIn("-(BOOL) getNextCommentsPageWithPageResult:(RKMappingResult*)pageResult success:", header)
+        self.assertIn("limit = @20;", body)
+
+class SymbolTableTest(unittest.TestCase):
+
+    def test_indexes(self):
+        model = manticom.build_schema_model(SCHEMA)
+        symbols = model["symbols"]
+        graph = model["graph"]
+
+        self.assertEqual(symbols["names"], ["MCMeta", "error", "user", "userUpdate", "postFilter", "post", "postCreate", "comment"])
+        self.assertEqual(symbols["objects"]["post"].class_name, "Post")
+        self.assertIsNone(manticom.find_object(symbols, "missing"))
+        self.assertEqual(symbols["referenced_by"]["user"], ["users/:username/"])
+        self.assertEqual(symbols["referenced_by"]["post"], ["posts/"])
+        self.assertEqual(symbols["referenced_by"]["error"], ["nil"])
+
+        self.assertEqual(graph["edges"]["post"], ["user"])
+        self.assertEqual(graph["dependents"]["user"], ["post"])
+        self.assertEqual(graph["closure"]["post"], frozenset(["post", "user"]))
+        self.assertEqual(graph["cycles"], [])
+
+    def test_cycles(self):
+        capture = manticom.LogCapture()
+        logging.getLogger().addHandler(capture)
+        try:
+            graph = manticom.build_schema_model(CYCLIC_SCHEMA)["graph"]
+        finally:
+            logging.getLogger().removeHandler(capture)
+
+        self.assertEqual(graph["cycles"], [["user", "post"]])
+        self.assertEqual(graph["closure"]["user"], frozenset(["user", "post", "tag"]))
+        self.assertIs(graph["closure"]["user"], graph["closure"]["post"])
+        self.assertEqual(graph["closure"]["tag"], frozenset(["tag"]))
+        self.assertIn((logging.ERROR, "Objects reference each other in a cycle: user -> post -> user"), capture.messages)
+
+class SymbolRegistryTest(GenerationTestCase):
+
+    def test_claim(self):
+        registry = manticom.SymbolRegistry("Selector")
+        self.assertEqual(registry.claim("users", "get `users/`"), "users")
+        self.assertEqual(registry.claim("users", "get `users`"), "users2")
+        self.assertEqual(registry.claim("users", "get `/users/`"), "users3")
+        self.assertEqual(len(self.logged("collides with the one of get `users/`")), 2)
+
+    def test_colliding_descriptor_names(self):
+        self.generate({"urls" : [{"url" : "users/", "get" : {"response" : "$user"}},
+                                 {"url" : "uploads/", "get" : {"response" : "$user"}}],
+                       "objects" : [{"$user" : {"username" : "string,primary"}}]})
+        body = self.read("Machine/MachineDataModel.m")
+
+        self.assertIn("RKResponseDescriptor* user_ResponseGet_u = ", body)
+        self.assertIn("RKResponseDescriptor* user_ResponseGet_u2 = ", body)
+        self.assertIn("[manager addResponseDescriptorsFromArray:@[user_ResponseGet_u, user_ResponseGet_u2]];", body)
+
+class ObjectFileTest(GenerationTestCase):
+
+    def test_object_files(self):
+        self.generate(SCHEMA)
+
+        self.assertEqual(sorted(os.listdir(os.path.join(self.project_dir, "Objects"))), OBJECT_FILES)
+        header = self.read("Objects/Post.h")
+        self.assertIn('#import "User.h"', header)
+        self.assertIn("@interface Post : NSManagedObject", header)
+        self.assertIn("@property(nonatomic, retain) User* author;", header)
+        self.assertIn("@dynamic title;", self.read("Objects/Post.m"))
+        self.assertIn("@synthesize title;", self.read("Objects/PostCreate.m"))
+
+    def test_date_is_kept_when_contents_are_unchanged(self):
+        self.generate(SCHEMA)
+        path = os.path.join(self.project_dir, "Objects/User.h")
+        text = self.read("Objects/User.h")
+        values = manticom.match_template(manticom.compile_template(manticom.template_dir + manticom.template_file), text)
+        self.assertEqual(values["viewName"], "User")
+        f = open(path, "w")
+        f.write(text.replace(values["date"], "2001-02-03").replace(values["year"], "2001"))
+        f.close()
+        os.utime(path, (0, 0))
+
+        state = self.generate(SCHEMA)
+        self.assertIn("on 2001-02-03.", self.read("Objects/User.h"))
+        self.assertEqual(os.stat(path).st_mtime, 0)
+        self.assertFalse(state["metrics"].counts.get("files changed"))
+
+    def test_only_changed_contents_are_written(self):
+        # attributes are emitted in the order of the decoded definitions, both schemas are decoded
+        schema = json.loads(json.dumps(SCHEMA))
+        self.generate(schema)
+        path = os.path.join(self.project_dir, "Objects/Post.h")
+        os.utime(path, (0, 0))
+        schema["objects"][2]["$user"]["bio"] = "text"
+
+        state = self.generate(schema)
+        self.assertIn("@property(nonatomic, retain) NSString* bio;", self.read("Objects/User.h"))
+        self.assertEqual(state["metrics"].counts["files changed"], 3) # User.h, User.m and MachineDataModel.m
+        self.assertEqual(os.stat(path).st_mtime, 0)
+
+    def test_stale_files_are_deleted(self):
+        self.generate(SCHEMA)
+        schema = json.loads(json.dumps(SCHEMA))
+        del schema["urls"][4]
+
+        self.generate(schema)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.project_dir, "Objects"))),
+                         [name for name in OBJECT_FILES if not name.startswith("Comment.")])
+
+    def test_unchanged_objects_are_skipped_with_a_schema_cache(self):
+        cache_dir = os.path.join(self.project_dir, "cache")
+        state = self.generate(SCHEMA, cache_dir=cache_dir)
+        manticom.prune_caches()
+        path = os.path.join(self.project_dir, "Objects/User.h")
+        f = open(path, "a")
+        f.write("// edited\n")
+        f.close()
+
+        # the objects are loaded again from the cache, they are distinct instances
+        state = self.generate(SCHEMA, cache_dir=cache_dir, previous=state)
+        self.assertEqual(state["metrics"].counts["schema cache hits"], 1)
+        self.assertTrue(self.read("Objects/User.h").endswith("// edited\n"))
+
+    def test_warnings_of_shared_objects_are_logged_for_every_schema(self):
+        schema = {"urls" : [{"url" : "tags/", "get" : {"response" : "$tag"}}],
+                  "objects" : [{"$tag" : {"#meta" : "cached,unknown", "name" : "string,primary"}}]}
+        manticom.generate_batch([(schema, "username", os.path.join(self.project_dir, "a")),
+                                 (schema, "username", os.path.join(self.project_dir, "b"))])
+
+        self.assertEqual(len(self.logged("Don't understand the meta tag ['unknown'] for variable tag")), 2)
+
+class CheckTest(GenerationTestCase):
+
+    def setUp(self):
+        GenerationTestCase.setUp(self)
+        self.schema_path = os.path.join(self.project_dir, "schema.json")
+        f = open(self.schema_path, "w")
+        json.dump(SCHEMA, f)
+        f.close()
+
+    def check(self):
+        return manticom.main(["--check", "-u", "username", "-o", self.project_dir, self.schema_path])
+
+    def test_check(self):
+        self.assertEqual(self.check(), 1)
+        self.assertEqual(os.listdir(self.project_dir), ["schema.json"])
+        self.assertTrue(self.logged("Missing User.h"))
+
+        self.assertEqual(manticom.main(["-f", "-u", "username", "-o", self.project_dir, self.schema_path]), 0)
+        self.assertEqual(self.check(), 0)
+
+        f = open(os.path.join(self.project_dir, "Objects/Stale.h"), "w")
+        f.close()
+        self.assertEqual(self.check(), 1)
+        self.assertTrue(self.logged("Stale Stale.h"))
+        self.assertTrue(os.path.isfile(os.path.join(self.project_dir, "Objects/Stale.h")))
+
+    def test_check_does_not_store_the_schema_cache(self):
+        cache_dir = os.path.join(self.project_dir, "cache")
+        manticom.main(["--check", "-c", cache_dir, "-u", "username", "-o", self.project_dir, self.schema_path])
+        self.assertFalse(os.path.exists(cache_dir))
+
+class SchemaCacheTest(GenerationTestCase):
+
+    def test_round_trip(self):
+        cache_dir = os.path.join(self.project_dir, "cache")
+        state = self.generate(SCHEMA, cache_dir=cache_dir)
+        self.assertFalse(state["metrics"].counts.get("schema cache hits"))
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        body = self.read("Machine/MachineDataModel.m")
+
+        state = self.generate(SCHEMA, cache_dir=cache_dir)
+        self.assertEqual(state["metrics"].counts["schema cache hits"], 1)
+        self.assertEqual(self.read("Machine/MachineDataModel.m"), body)
+
+    def test_invalidation(self):
+        cache_dir = os.path.join(self.project_dir, "cache")
+        self.generate(SCHEMA, cache_dir=cache_dir)
+        schema = json.loads(json.dumps(SCHEMA))
+        schema["objects"][2]["$user"]["bio"] = "text"
+
+        state = self.generate(schema, cache_dir=cache_dir)
+        self.assertFalse(state["metrics"].counts.get("schema cache hits"))
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+        self.assertIn("bio", self.read("Objects/User.h"))
+
+    def test_unreadable_entry_is_rebuilt(self):
+        cache_dir = os.path.join(self.project_dir, "cache")
+        self.generate(SCHEMA, cache_dir=cache_dir)
+        path = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+        f = open(path, "w")
+        f.write("garbage")
+        f.close()
+
+        state = self.generate(SCHEMA, cache_dir=cache_dir)
+        self.assertFalse(state["metrics"].counts.get("schema cache hits"))
+        self.assertTrue(self.logged("Ignoring the unreadable schema cache"))
+
+    def test_cached_warnings_are_logged(self):
+        cache_dir = os.path.join(self.project_dir, "cache")
+        schema = {"urls" : [{"url" : "tags/", "get" : {"response" : "$tag"}}],
+                  "objects" : [{"$tag" : {"#meta" : "cached,unknown", "name" : "string,primary"}}]}
+        self.generate(schema, cache_dir=cache_dir)
+        self.generate(schema, cache_dir=cache_dir)
+
+        self.assertEqual(len(self.logged("Don't understand the meta tag ['unknown'] for variable tag")), 2)
+
+class ShardTest(GenerationTestCase):
+
+    def test_categories(self):
+        self.generate(SCHEMA, shard=True)
+
+        self.assertEqual(sorted(os.listdir(os.path.join(self.project_dir, "Machine"))),
+                         ["MachineDataModel+%s.%s" % (category, extension)
+                          for category in ["CommentsEndpoints", "ObjectMappings", "PostsEndpoints", "UsersEndpoints"]
+                          for extension in ["h", "m"]] + ["MachineDataModel.h", "MachineDataModel.m"])
+        header = self.read("Machine/MachineDataModel.h")
+        self.assertIn('#import "MachineDataModel+PostsEndpoints.h"', header)
+        body = self.read("Machine/MachineDataModel.m")
+        self.assertIn("NSDictionary* mappings = [self objectMappingsWithStore:managedObjectStore];", body)
+        self.assertIn("[self setupPostsEndpointsWithMappings:mappings manager:manager];", body)
+        self.assertIn("-(void) getPostsPageWithAuthor:", self.read("Machine/MachineDataModel+PostsEndpoints.h"))
+
+    def test_stale_categories_are_deleted(self):
+        self.generate(SCHEMA, shard=True)
+        self.generate(SCHEMA)
+
+        self.assertEqual(sorted(os.listdir(os.path.join(self.project_dir, "Machine"))), ["MachineDataModel.h", "MachineDataModel.m"])
+
+    def test_same_methods_as_unsharded(self):
+        self.generate(SCHEMA)
+        header = self.read("Machine/MachineDataModel.h")
+        methods = [line for line in header.split("\n") if line.startswith("-(") and line != "-(void)setupMapping;"]
+        self.generate(SCHEMA, shard=True)
+
+        sharded = "".join([self.read("Machine/MachineDataModel+%sEndpoints.h" % category) for category in ["Users", "Posts", "Comments"]])
+        self.assertEqual([line for line in sharded.split("\n") if line.startswith("-(") and not "WithMappings" in line], methods)
+
+class LazyTest(GenerationTestCase):
+
+    def test_lazy_mappings_and_descriptors(self):
+        self.generate(SCHEMA, lazy=True)
+        body = self.read("Machine/MachineDataModel.m")
+
+        self.assertIn("static RKObjectMapping* getPostResponseMapping(void) {", body)
+        self.assertIn("static void registerPostsDescriptors(void) {\nregisterRootDescriptors();\nstatic dispatch_once_t once;", body)
+        self.assertIn("-(void) getAllCommentsWithSuccess:(void (^)(RKObjectRequestOperation *operation, RKMappingResult *mappingResult))success failure:(void (^)(RKObjectRequestOperation *operation, NSError *error))failure {\nregisterCommentsDescriptors();", body)
+        self.assertNotIn("addResponseDescriptorsFromArray:@[user_", body.split("-(void)setupMapping")[1].split("\n}\n")[0])
+
+    def test_cycles_are_built_together(self):
+        self.generate(CYCLIC_SCHEMA, lazy=True)
+        body = self.read("Machine/MachineDataModel.m")
+
+        self.assertIn("static void buildUserResponseMappings(void) {", body)
+        self.assertIn("static RKObjectMapping* getPostResponseMapping(void) {\nbuildUserResponseMappings();\nreturn lazyPostResponseMapping;", body)
+        self.assertIn("static RKObjectMapping* getTagResponseMapping(void) {\nstatic RKObjectMapping* mapping = nil;", body)
+
+    def test_shard_and_lazy_are_exclusive(self):
+        self.assertRaises(ValueError, self.generate, SCHEMA, shard=True, lazy=True)
+
+class CoreDataModelTest(GenerationTestCase):
+
+    def test_entities(self):
+        self.generate(SCHEMA, core_data_model=True)
+        model = self.read("Machine/" + manticom.CORE_DATA_MODEL_PATH)
+
+        self.assertEqual(model.count("<entity "), 3)
+        self.assertIn('<entity name="Post" representedClassName="Post" syncable="YES">', model)
+        self.assertIn('<attribute name="theID" attributeType="Integer 32" indexed="YES" syncable="YES"/>', model)
+        self.assertIn('<attribute name="title" attributeType="String" syncable="YES"/>', model)
+        self.assertIn('<relationship name="author" optional="YES" maxCount="1" deletionRule="Nullify" destinationEntity="User" syncable="YES"/>', model)
+        self.assertIn('<compoundIndex>\n                <index value="title"/>\n                <index value="theID"/>\n            </compoundIndex>', model)
+        self.assertNotIn("PostCreate", model)
+
+    def test_managed_object_cache(self):
+        self.generate(SCHEMA)
+        self.assertIn("managedObjectStore.managedObjectCache = [[RKInMemoryManagedObjectCache alloc]", self.read("Machine/MachineDataModel.m"))
+
+        schema = dict(SCHEMA)
+        schema["#meta"] = "fetchrequestcache"
+        self.generate(schema)
+        self.assertIn("managedObjectStore.managedObjectCache = [[RKFetchRequestManagedObjectCache alloc] init];", self.read("Machine/MachineDataModel.m"))
+
+class OperationTest(GenerationTestCase):
+
+    def setUp(self):
+        GenerationTestCase.setUp(self)
+        self.generate(SCHEMA)
+        self.header = self.read("Machine/MachineDataModel.h")
+        self.body = self.read("Machine/MachineDataModel.m")
+
+    # the implementation of the method starting with signature, up to the next method
+    def method_body(self, signature):
+        start = self.body.index(signature)
+        end = self.body.find("\n-(", start)
+        return self.body[start:end if end != -1 else len(self.body)]
+
+    def test_conditional_get(self):
+        body = self.method_body("-(void) getAllUsersUsernameWithUsername:")
+
+        self.assertIn('[request setValue:[validated objectForKey:@"ETag"] forHTTPHeaderField:@"If-None-Match"];', body)
+        self.assertIn('[request setValue:[validated objectForKey:@"Last-Modified"] forHTTPHeaderField:@"If-Modified-Since"];', body)
+        self.assertIn("[sharedMgr enqueueObjectRequestOperation:operation];", body)
+        self.assertNotIn("setDefaultHeader", self.body)
+
+    def test_coalesced_get(self):
+        body = self.method_body("-(void) getAllUsersUsernameWithUsername:")
+
+        self.assertIn('NSString* requestKey = [NSString stringWithFormat:@"GET %@ %@", fullUrl, nil];', body)
+        self.assertIn("[waiting addObject:callback];\n    return;", body)
+        self.assertNotIn("pendingRequests", self.method_body("-(void) getAllCommentsWith"))
+
+    def test_bulk_post(self):
+        self.assertIn("-(void) bulkPostPostsWithObjects:(NSArray*)objects success:", self.header)
+        body = self.method_body("-(void) bulkPostPostsWithObjects:")
+
+        self.assertIn("NSUInteger batchSize = 100;", body)
+        self.assertIn("method:RKRequestMethodPATCH path:@\"posts/\"", body)
+        self.assertIn("(descriptor.method & RKRequestMethodPOST)", body)
+        self.assertIn("initWithRequest:request responseDescriptors:responseDescriptors]", body)
+        self.assertIn("error = [NSError errorWithDomain:RKErrorDomain", body)
+
+    def test_sparse_get(self):
+        self.assertIn("-(void) getAllPostsWithAuthor:(NSString*)author fields:(NSArray*)fields expand:(NSArray*)expand success:", self.header)
+        body = self.method_body("-(void) getAllPostsWithAuthor:(NSString*)author fields:")
+
+        self.assertIn('[sparseParamDict setObject:[fields componentsJoinedByString:@","] forKey:@"fields"];', body)
+        self.assertIn('[sparseParamDict setObject:[expand componentsJoinedByString:@","] forKey:@"expand"];', body)
+        self.assertIn("((RKObjectMapping*)descriptor.mapping).objectClass != [Post class]", body)
+
+    def test_operations_are_only_generated_when_tagged(self):
+        self.assertNotIn("bulkPatch", self.header)
+        self.assertNotIn("-(void) getAllCommentsWithFields:", self.header)
+        self.assertNotIn("validatedResults", self.method_body("-(void) getAllPostsWithAuthor:(NSString*)author success:"))
+
+if __name__ == "__main__":
+    unittest.main()